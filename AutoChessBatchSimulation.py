@@ -3,9 +3,15 @@ import os
 import json
 import math
 import random
-from AutoChessGameSimulation import initialize_game, generate_filename, calculate_lattice_position_with_jitter
 from AutoChessEngine import Game, SimulationCreature, Arena, SimulationGame, Obstacle
+from AutoChessBrain import create_brain
+from AutoChessCatalog import PlaybackCatalog, DEFAULT_CATALOG_PATH
+from AutoChessPlaybackWriter import PlaybackWriter
+from AutoChessPlaybackIO import COMPRESSION_EXTENSIONS
+from AutoChessRunningStatistics import RunningStatistics
 import hashlib
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 def load_experiment_config(config_file):
     with open(config_file, 'r') as file:
@@ -37,7 +43,7 @@ class CreatureSpawner:
 
     def spawn_creatures(self, creature_counts, game):
         creatures = []
-        obstacles = [obj for obj in game.game_objects if isinstance(obj, Obstacle)]
+        obstacles = game.obstacles
 
         for creature_type, count in creature_counts.items():
             for i in range(count):
@@ -73,6 +79,86 @@ def create_creature(creature_type, position, i, creature_config):
         sprite_filename=creature_config[creature_type]['sprite_filename'],  
     )
 
+def wilson_interval(successes, trials, z):
+    """Wilson score interval of a proportion, stays inside [0, 1] and behaves with few trials or extreme rates."""
+    if trials == 0:
+        return 0.0, 1.0
+    rate = successes / trials
+    center = (rate + z * z / (2 * trials)) / (1 + z * z / trials)
+    half_width = z * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / (1 + z * z / trials)
+    return center - half_width, center + half_width
+
+
+class BatchStoppingRule:
+    """Stops a batch once the win rate and mean score of every creature type are known precisely enough.
+
+    win_rate_precision and score_precision are the largest half-widths
+    allowed for the intervals at the given confidence, either may be left
+    out. Win rates use Wilson intervals. Scores are averaged per game
+    before the normal interval is taken, since creatures of one game are
+    not independent. Nothing stops before min_simulations games.
+    """
+    def __init__(self, creature_types, stopping_config):
+        self.creature_types = list(creature_types)
+        self.confidence = stopping_config.get('confidence', 0.95)
+        self.z = NormalDist().inv_cdf((1 + self.confidence) / 2)
+        self.win_rate_precision = stopping_config.get('win_rate_precision')
+        self.score_precision = stopping_config.get('score_precision')
+        self.min_simulations = stopping_config.get('min_simulations', 10)
+        self.num_games = 0
+        self.wins = {creature_type: 0 for creature_type in self.creature_types}
+        self.scores = {creature_type: RunningStatistics() for creature_type in self.creature_types}
+
+    def add(self, summary):
+        self.num_games += 1
+        winner_type = creature_type_of(summary['winner'])
+        if winner_type in self.wins:
+            self.wins[winner_type] += 1
+        game_scores = {creature_type: [] for creature_type in self.creature_types}
+        for name, score in summary['scores'].items():
+            game_scores.setdefault(creature_type_of(name), []).append(score)
+        for creature_type, running_statistics in self.scores.items():
+            if game_scores[creature_type]:
+                running_statistics.add(sum(game_scores[creature_type]) / len(game_scores[creature_type]))
+
+    def score_half_width(self, creature_type):
+        stdev = self.scores[creature_type].stdev()
+        return math.inf if stdev is None else self.z * stdev / math.sqrt(self.scores[creature_type].count)
+
+    def is_precise(self):
+        if self.num_games < self.min_simulations:
+            return False
+        for creature_type in self.creature_types:
+            if self.win_rate_precision is not None:
+                low, high = wilson_interval(self.wins[creature_type], self.num_games, self.z)
+                if (high - low) / 2 > self.win_rate_precision:
+                    return False
+            if self.score_precision is not None and self.score_half_width(creature_type) > self.score_precision:
+                return False
+        return True
+
+    def to_dict(self, reason):
+        intervals = {}
+        for creature_type in self.creature_types:
+            low, high = wilson_interval(self.wins[creature_type], self.num_games, self.z)
+            mean = self.scores[creature_type].average()
+            half_width = self.score_half_width(creature_type)
+            intervals[creature_type] = {
+                'win_rate': self.wins[creature_type] / self.num_games if self.num_games else None,
+                'win_rate_interval': [low, high],
+                'mean_score': mean,
+                'mean_score_interval': [mean - half_width, mean + half_width] if math.isfinite(half_width) else None,
+            }
+        return {
+            'reason': reason,
+            'num_simulations': self.num_games,
+            'confidence': self.confidence,
+            'win_rate_precision': self.win_rate_precision,
+            'score_precision': self.score_precision,
+            'creature_types': intervals,
+        }
+
+
 class AutoChessBatchedSimulator:
     def __init__(self, experiment_config):
         self.experiment_config = experiment_config
@@ -84,6 +170,26 @@ class AutoChessBatchedSimulator:
         self.arena_sizes = experiment_config['arena_sizes']
         self.creature_config = experiment_config['creature_config']
         self.obstacles_config = experiment_config['obstacles']  # Add this line to store the obstacles configuration
+        self.brain_name = experiment_config.get('brain')  # Optional batched AI, per-creature think() when absent
+        # Optional two-phase tick, whose brain think phase may run on a "thread" or "process" pool
+        self.tick_mode = experiment_config.get('tick_mode', 'interleaved')
+        self.think_workers = experiment_config.get('think_workers', 1)
+        self.think_executor_type = experiment_config.get('think_executor', 'thread')
+        self.parallel_think_threshold = experiment_config.get('parallel_think_threshold', 64)
+        self.think_executor = None
+        # Every recorded game and the batch output are indexed in the playback catalog
+        self.catalog = PlaybackCatalog(experiment_config.get('catalog', DEFAULT_CATALOG_PATH))
+        # Playbacks are written in the background ("thread" or "process") while the next game runs,
+        # at most playback_queue_size of them wait for the disk before the simulation blocks
+        self.playback_writer_mode = experiment_config.get('playback_writer', 'thread')
+        self.playback_queue_size = experiment_config.get('playback_queue_size', 2)
+        self.fsync_playbacks = experiment_config.get('fsync_playbacks', False)
+        self.playback_compression = experiment_config.get('playback_compression')  # None, "gz" or "xz"
+        self.playback_writer = None
+        # Optional sequential stopping, num_simulations is then the budget rather than the batch size
+        self.stopping_config = experiment_config.get('stopping')
+        self.stopping = None  # Why the last batch stopped, for the batch output
+        self.num_simulations_run = None
 
         self.experiment_hash = self.generate_experiment_hash(experiment_config)
 
@@ -103,7 +209,10 @@ class AutoChessBatchedSimulator:
         arena_size = random.choice(self.arena_sizes)
         arena = Arena(width=arena_size, height=arena_size)
 
-        game = SimulationGame(arena, [], experiment_hash=self.experiment_hash)
+        brain = create_brain(self.brain_name) if self.brain_name else None
+        game = SimulationGame(arena, [], experiment_hash=self.experiment_hash, brain=brain, tick_mode=self.tick_mode,
+                              think_executor=self.think_executor, think_workers=self.think_workers,
+                              parallel_think_threshold=self.parallel_think_threshold)
         Game.reset_time()
 
         # Add obstacles to the game
@@ -123,47 +232,106 @@ class AutoChessBatchedSimulator:
         game.creature_counts = creature_counts
         return game
 
-    def run_simulation(self, simulation_number):
+    def run_simulation(self, simulation_number, record=True):
         self.game = self.initialize_game()
         while True:
             self.game.simulate_turn()
-            alive_creatures = [creature for creature in self.game.game_objects if isinstance(creature, SimulationCreature) and creature.health > 0]
-            if len(alive_creatures) == 1:
-                self.game.winner = alive_creatures[0].name
+            # Dead creatures leave the registry, so the count is the number alive
+            if self.game.creature_count == 1:
+                self.game.winner = self.game.creatures[0].name
                 break
             if Game.get_time() >= self.time_limit:
-                creatures_by_score = sorted([obj for obj in self.game.game_objects if isinstance(obj, SimulationCreature)], key=lambda creature: creature.score, reverse=True)
+                creatures_by_score = sorted(self.game.creatures, key=lambda creature: creature.score, reverse=True)
                 self.game.winner = creatures_by_score[0].name if creatures_by_score else None
                 break
 
-        filename = generate_batch_filename(self.game.creature_counts, self.experiment_hash, simulation_number)
-        self.game.record_game(f"playbacks/{filename}")
-        print(f"Simulation saved to playbacks/{filename}")
+        if not record:
+            return game_summary(self.game)
+        filename = generate_batch_filename(self.game.creature_counts, self.experiment_hash, simulation_number,
+                                           self.playback_compression)
+        if self.playback_writer is not None:
+            self.playback_writer.write(f"playbacks/{filename}", self.game.build_game_record())
+        else:
+            self.game.record_game(f"playbacks/{filename}", self.catalog)
+            print(f"Simulation saved to playbacks/{filename}")
+        summary = game_summary(self.game)
+        summary['path'] = f"playbacks/{filename}"
+        return summary
 
 
 
-    def run_batch_simulations(self, num_simulations):
-        for i in range(num_simulations):
-            print(f"Running simulation {i + 1} of {num_simulations}")
-            self.run_simulation(i + 1)
+    def run_batch_simulations(self, num_simulations, first_simulation=1):
+        """Run and record num_simulations games, numbered from first_simulation, returns their game_summary."""
+        # The think pool is shared by every game of the batch
+        if self.tick_mode == 'two_phase' and self.think_workers > 1:
+            executor_class = ProcessPoolExecutor if self.think_executor_type == 'process' else ThreadPoolExecutor
+            self.think_executor = executor_class(max_workers=self.think_workers)
+        self.playback_writer = PlaybackWriter(self.playback_writer_mode, self.playback_queue_size,
+                                              self.catalog.path, self.fsync_playbacks)
+        stopping_rule = BatchStoppingRule(self.creature_types, self.stopping_config) if self.stopping_config else None
+        summaries = []
+        try:
+            for i in range(num_simulations):
+                print(f"Running simulation {i + 1} of {num_simulations}")
+                summaries.append(self.run_simulation(first_simulation + i))
+                if stopping_rule is not None:
+                    stopping_rule.add(summaries[-1])
+                    if stopping_rule.is_precise():
+                        print(f"Stopping after {i + 1} simulations, the requested precision is reached")
+                        break
+        finally:
+            # Also on Ctrl-C, so every finished game reaches the disk
+            self.playback_writer.close()
+            self.playback_writer = None
+            if self.think_executor is not None:
+                self.think_executor.shutdown()
+                self.think_executor = None
+        self.num_simulations_run = len(summaries)
+        if stopping_rule is not None:
+            reason = 'precision_reached' if stopping_rule.is_precise() else 'max_simulations'
+            self.stopping = stopping_rule.to_dict(reason)
+        return summaries
 
-    def save_batch_output(self, output_file):
+    def save_batch_output(self, output_file, num_simulations=None, score_values=None, details=None):
+        """Write the batch output, num_simulations defaults to the games of the last batch and score_values to its last game."""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")  # Generate a timestamp
         batch_output = {
             'experiment_config': self.experiment_config,
             'experiment_hash': self.experiment_hash,
-            'score_values': self.game.score_values,
-            'num_simulations': self.experiment_config['num_simulations']
+            'score_values': score_values or self.game.score_values,
+            'num_simulations': num_simulations or self.num_simulations_run or self.experiment_config['num_simulations']
         }
+        if self.stopping is not None:
+            batch_output['stopping'] = self.stopping
+        batch_output.update(details or {})  # Extra results of runners built on the batch simulator
+        os.makedirs("experiments", exist_ok=True)
         output_path = os.path.join("experiments", f"{output_file}_{timestamp}.json")  # Include timestamp in the file name
         with open(output_path, 'w') as file:
             json.dump(batch_output, file, indent=4)
+        self.catalog.upsert_experiment(batch_output, output_path)
+
+
+def creature_type_of(name):
+    # Creatures are named "<creature_type> <index>"
+    return name.split(' ')[0] if name else None
+
+
+def game_summary(game):
+    """Winner and final scores of a finished game, small enough to send back from a worker process."""
+    all_creatures = game.creatures + game.fallen_creatures
+    return {
+        'winner': game.winner,
+        'scores': {creature.name: creature.score for creature in all_creatures},
+        'score_values': game.score_values,
+        'turns': Game.get_time(),
+    }
 
 
-def generate_batch_filename(creature_counts, experiment_hash, simulation_number):
+def generate_batch_filename(creature_counts, experiment_hash, simulation_number, compression=None):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")  # Generate a timestamp
     game_hash = f"{experiment_hash}_{simulation_number}"
-    return f"AutoChessSimulationRun--{timestamp}--{game_hash}.json"  # Include timestamp in the file name
+    extension = COMPRESSION_EXTENSIONS[compression]  # .json, .json.gz or .json.xz
+    return f"AutoChessSimulationRun--{timestamp}--{game_hash}{extension}"  # Include timestamp in the file name
 
 if __name__ == "__main__":
     experiment_config_file = 'experiment_config.json'
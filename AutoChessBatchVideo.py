@@ -0,0 +1,129 @@
+# AutoChessBatchVideo.py
+
+import argparse
+import os
+import random
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from moviepy.config import get_setting
+from AutoChessPlaybackToVideo import AutoChessPlaybackToVideo
+from AutoChessPlaybackIO import find_playbacks, load_playback, playback_base_name
+
+
+def video_path_for(playback_path, output_dir):
+    base_name = playback_base_name(playback_path)
+    return os.path.join(output_dir, f"v_{base_name}.mp4")
+
+
+def is_up_to_date(playback_path, video_path):
+    return os.path.exists(video_path) and os.path.getmtime(video_path) >= os.path.getmtime(playback_path)
+
+
+def count_ticks(playback_path):
+    return len(load_playback(playback_path)['events'])
+
+
+def plan_segments(num_ticks, segment_ticks):
+    """Split ticks 0..num_ticks-1 into (first_tick, last_tick) ranges of at most segment_ticks."""
+    return [(first_tick, min(first_tick + segment_ticks, num_ticks) - 1)
+            for first_tick in range(0, num_ticks, segment_ticks)]
+
+
+def render_video(playback_path, video_path, fps, first_tick=0, last_tick=None):
+    """Render one playback, or one tick range of it, to video_path. Runs in a worker process."""
+    # Creature colors are random, seeding from the playback name keeps them the same in every segment
+    random.seed(os.path.basename(playback_path))
+    player = AutoChessPlaybackToVideo(playback_path, frame_rate=fps)
+    # Encode under a temporary name so an interrupted render is never taken as up to date
+    partial_path = video_path[:-len('.mp4')] + '.partial.mp4'
+    player.video_file = partial_path
+    player.run(first_tick, last_tick)
+    os.replace(partial_path, video_path)
+    return video_path
+
+
+def concatenate_videos(segment_paths, video_path):
+    """Join segments encoded with the same settings into one video without re-encoding."""
+    list_path = video_path[:-len('.mp4')] + '.segments.txt'
+    partial_path = video_path[:-len('.mp4')] + '.partial.mp4'
+    with open(list_path, 'w') as f:
+        for segment_path in segment_paths:
+            f.write(f"file '{os.path.abspath(segment_path)}'\n")
+    try:
+        subprocess.run([get_setting("FFMPEG_BINARY"), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                        '-i', list_path, '-c', 'copy', partial_path], check=True)
+        os.replace(partial_path, video_path)
+    finally:
+        os.remove(list_path)
+        for segment_path in segment_paths:
+            if os.path.exists(segment_path):
+                os.remove(segment_path)
+
+
+def render_directory(playback_dir, output_dir=None, fps=20, workers=None, segment_ticks=None, force=False):
+    """Render every playback of a directory on a pool of headless workers.
+
+    Playbacks whose video exists and is newer than the playback are skipped
+    unless force is set. With segment_ticks, playbacks longer than that are
+    rendered as tick ranges in parallel and concatenated. Returns the paths
+    of the videos that were rendered.
+    """
+    output_dir = output_dir or playback_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    playback_paths = find_playbacks(playback_dir)
+    pending = []
+    for playback_path in playback_paths:
+        video_path = video_path_for(playback_path, output_dir)
+        if force or not is_up_to_date(playback_path, video_path):
+            pending.append((playback_path, video_path))
+    print(f"Rendering {len(pending)} videos, skipping {len(playback_paths) - len(pending)} up-to-date ones")
+
+    rendered = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Submit everything first so segments of different playbacks share the pool
+        jobs = []
+        for playback_path, video_path in pending:
+            if segment_ticks:
+                segments = plan_segments(count_ticks(playback_path), segment_ticks)
+            else:
+                segments = [(0, None)]
+            if len(segments) == 1:
+                futures = [executor.submit(render_video, playback_path, video_path, fps)]
+                segment_paths = None
+            else:
+                segment_paths = [video_path[:-len('.mp4')] + f'.seg{index:03d}.mp4' for index in range(len(segments))]
+                futures = [executor.submit(render_video, playback_path, segment_path, fps, first_tick, last_tick)
+                           for segment_path, (first_tick, last_tick) in zip(segment_paths, segments)]
+            jobs.append((playback_path, video_path, futures, segment_paths))
+
+        for playback_path, video_path, futures, segment_paths in jobs:
+            try:
+                for future in futures:
+                    future.result()
+                if segment_paths:
+                    concatenate_videos(segment_paths, video_path)
+            except Exception as e:
+                print(f"Failed to render {playback_path}: {e}")
+                continue
+            print(f"Rendered {video_path}")
+            rendered.append(video_path)
+
+    return rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render every AutoChess replay of a directory to video, in parallel.')
+    parser.add_argument('playback_dir', type=str, help='Directory containing the JSON playback files.')
+    parser.add_argument('fps', type=int, nargs='?', default=20, help='Frames per second for the output videos.')
+    parser.add_argument('-o', '--output-dir', type=str, help='Directory for the videos, defaults to the playback directory.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, defaults to the number of CPUs.')
+    parser.add_argument('-s', '--segment-ticks', type=int, help='Split playbacks longer than this many ticks into parallel segments.')
+    parser.add_argument('--force', action='store_true', help='Render even when an up-to-date video exists.')
+
+    args = parser.parse_args()
+
+    render_directory(args.playback_dir, args.output_dir, args.fps, args.workers, args.segment_ticks, args.force)
+
+if __name__ == "__main__":
+    main()
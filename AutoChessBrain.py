@@ -0,0 +1,161 @@
+import numpy as np
+
+
+class CreatureSnapshot:
+    """State of every living creature at the start of a tick, one array row per creature."""
+    def __init__(self, creatures, arena):
+        self.creatures = list(creatures)  # Row order, used to hand the actions back
+        self.arena_center = (arena.width / 2, arena.height / 2)
+
+        self.ids = np.array([creature.id for creature in self.creatures], dtype=np.int64)
+        self.x = np.array([creature.position[0] for creature in self.creatures], dtype=float)
+        self.y = np.array([creature.position[1] for creature in self.creatures], dtype=float)
+        self.angle = np.array([creature.angle for creature in self.creatures], dtype=float)
+        self.health = np.array([creature.health for creature in self.creatures], dtype=float)
+        self.speed = np.array([creature.speed for creature in self.creatures], dtype=float)
+        self.max_turn_rate = np.array([creature.max_turn_rate for creature in self.creatures], dtype=float)
+        self.bullet_range = np.array([creature.bullet_range for creature in self.creatures], dtype=float)
+        self.shoot_timer = np.array([creature.shoot_timer for creature in self.creatures], dtype=float)
+        self.brake_timer = np.array([creature.brake_timer for creature in self.creatures], dtype=float)
+        self.is_braking = np.array([creature.is_braking for creature in self.creatures], dtype=bool)
+        self.blocked = np.array([creature.blocked for creature in self.creatures], dtype=bool)
+
+    def __len__(self):
+        return len(self.creatures)
+
+    def __getstate__(self):
+        # Only the arrays travel to worker processes, the creatures stay with the game
+        state = self.__dict__.copy()
+        state['creatures'] = []
+        state['count'] = len(self.creatures)
+        return state
+
+    def __setstate__(self, state):
+        count = state.pop('count')
+        self.__dict__.update(state)
+        self.creatures = [None] * count
+
+
+class BrainActions:
+    """Actions decided for a CreatureSnapshot, aligned with its rows."""
+    def __init__(self, target_x, target_y, brake, reverse, turn, shoot):
+        self.target_x = target_x
+        self.target_y = target_y
+        self.brake = brake
+        self.reverse = reverse
+        self.turn = turn
+        self.shoot = shoot
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Join the actions decided for consecutive row chunks."""
+        return cls(*(np.concatenate([getattr(part, field) for part in parts]) for field in
+                     ('target_x', 'target_y', 'brake', 'reverse', 'turn', 'shoot')))
+
+
+class Brain:
+    """Base class for creature AI policies that decide for all creatures in one call.
+
+    Subclasses implement decide(), which receives a CreatureSnapshot and
+    returns BrainActions for the requested rows (all of them when rows is
+    None). Set an instance as SimulationGame.brain to use it instead of the
+    per-creature SimulationCreature.think(). Brains must be picklable to run
+    on a process pool.
+    """
+    name = None
+
+    def decide(self, snapshot, rows=None):
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+    def think_all(self, game, executor=None, workers=1):
+        """Snapshot the creatures of the game, decide, and queue the actions on each creature.
+
+        With an executor, the rows are split into one chunk per worker and
+        decided in parallel. Chunks are joined back in row order, so the
+        result does not depend on which worker finishes first.
+        """
+        snapshot = CreatureSnapshot(game.creatures, game.arena)
+        if not len(snapshot):
+            return
+        if executor is None or workers <= 1:
+            actions = self.decide(snapshot)
+        else:
+            chunks = np.array_split(np.arange(len(snapshot)), workers)
+            futures = [executor.submit(self.decide, snapshot, rows) for rows in chunks if len(rows)]
+            actions = BrainActions.concatenate([future.result() for future in futures])
+
+        decisions = zip(
+            snapshot.creatures,
+            actions.target_x.tolist(),
+            actions.target_y.tolist(),
+            actions.brake.tolist(),
+            actions.reverse.tolist(),
+            actions.turn.tolist(),
+            actions.shoot.tolist(),
+        )
+        for creature, target_x, target_y, brake, reverse, turn, shoot in decisions:
+            creature.apply_decision((target_x, target_y), brake, reverse, turn, shoot)
+
+
+class NearestTargetBrain(Brain):
+    """Vectorized version of SimulationCreature.think().
+
+    Each creature aims at its nearest opponent (or the arena center when
+    alone), brakes once it is within bullet range and off brake cooldown,
+    reverses after a blocked move, and shoots when its cooldown is over and
+    the target is in range.
+    """
+    name = "nearest_target"
+
+    def decide(self, snapshot, rows=None):
+        n = len(snapshot)
+        if rows is None:
+            rows = np.arange(n)
+        count = len(rows)
+        x, y = snapshot.x[rows], snapshot.y[rows]
+
+        # Distances from the decided rows to every creature, a creature is never its own target
+        dx = snapshot.x[np.newaxis, :] - x[:, np.newaxis]
+        dy = snapshot.y[np.newaxis, :] - y[:, np.newaxis]
+        distances = np.hypot(dx, dy)
+        distances[np.arange(count), rows] = np.inf
+
+        if n > 1:
+            nearest = np.argmin(distances, axis=1)
+            distance_to_target = distances[np.arange(count), nearest]
+            target_x = snapshot.x[nearest]
+            target_y = snapshot.y[nearest]
+            has_target = np.ones(count, dtype=bool)
+        else:
+            distance_to_target = np.full(count, np.inf)
+            target_x = np.full(count, snapshot.arena_center[0])
+            target_y = np.full(count, snapshot.arena_center[1])
+            has_target = np.zeros(count, dtype=bool)
+
+        in_range = distance_to_target <= snapshot.bullet_range[rows]
+        brake = has_target & in_range & (snapshot.brake_timer[rows] == 0) & ~snapshot.is_braking[rows]
+        shoot = (snapshot.shoot_timer[rows] <= 0) & in_range
+
+        # Same turn computation as SimulationCreature.calculate_turn
+        target_angle = np.degrees(np.arctan2(target_y - y, target_x - x)) % 360
+        angle_diff = (target_angle - snapshot.angle[rows] + 360) % 360
+        angle_diff = np.where(angle_diff > 180, angle_diff - 360, angle_diff)
+        max_turn_rate = snapshot.max_turn_rate[rows]
+        turn = np.clip(angle_diff, -max_turn_rate, max_turn_rate)
+
+        return BrainActions(target_x, target_y, brake, snapshot.blocked[rows], turn, shoot)
+
+
+BRAINS = {
+    NearestTargetBrain.name: NearestTargetBrain,
+}
+
+DEFAULT_BRAIN = NearestTargetBrain.name
+
+
+def create_brain(name=None):
+    """Instantiate a registered brain by name, the default brain if no name is given."""
+    name = name or DEFAULT_BRAIN
+    if name not in BRAINS:
+        raise ValueError(f"Unknown brain '{name}'. Available brains: {', '.join(BRAINS)}")
+    return BRAINS[name]()
@@ -0,0 +1,216 @@
+# AutoChessCatalog.py
+
+import argparse
+import json
+import os
+import sqlite3
+from AutoChessMapReduce import map_reduce
+from AutoChessPlaybackIO import is_playback_path, load_playback
+
+DEFAULT_CATALOG_PATH = os.path.join('playbacks', 'catalog.sqlite')
+
+# Creature parameters copied from the playback header, each gets an index for ad-hoc queries.
+# NUMERIC columns keep integer scores and parameters as integers.
+CREATURE_PARAMETERS = ['health', 'speed', 'max_turn_rate', 'damage', 'bullet_speed', 'shoot_cooldown',
+                       'bullet_range', 'brake_cooldown', 'brake_power']
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS experiments (
+    experiment_hash TEXT PRIMARY KEY,
+    num_simulations INTEGER,
+    time_limit INTEGER,
+    experiment_config TEXT,
+    score_values TEXT,
+    path TEXT
+);
+CREATE TABLE IF NOT EXISTS games (
+    filename TEXT PRIMARY KEY,
+    path TEXT,
+    file_mtime REAL,
+    file_size INTEGER,
+    experiment_hash TEXT,
+    winner TEXT,
+    winner_score NUMERIC,
+    max_turns INTEGER,
+    num_creatures INTEGER,
+    arena_width REAL,
+    arena_height REAL,
+    brain TEXT,
+    tick_mode TEXT
+);
+CREATE TABLE IF NOT EXISTS creatures (
+    filename TEXT,
+    creature_id INTEGER,
+    experiment_hash TEXT,
+    name TEXT,
+    creature_type TEXT,
+    is_winner INTEGER,
+    score NUMERIC,
+    {', '.join(f'{parameter} NUMERIC' for parameter in CREATURE_PARAMETERS)},
+    PRIMARY KEY (filename, creature_id)
+);
+CREATE INDEX IF NOT EXISTS games_experiment_hash ON games (experiment_hash);
+CREATE INDEX IF NOT EXISTS games_winner ON games (winner);
+CREATE INDEX IF NOT EXISTS creatures_experiment_hash ON creatures (experiment_hash);
+{''.join(f'CREATE INDEX IF NOT EXISTS creatures_{parameter} ON creatures ({parameter});' for parameter in CREATURE_PARAMETERS)}
+"""
+
+
+def read_game_record(path):
+    """A playback record without its events, small enough to send back from a worker process."""
+    game_record = load_playback(path)
+    game_record.pop('events', None)
+    return game_record
+
+
+class PlaybackCatalog:
+    """SQLite index of playback headers and experiments.
+
+    Games are upserted when they are recorded, so statistics and ad-hoc
+    queries never have to parse the events of a playback. backfill() adds
+    playbacks and batch outputs written before the catalog existed.
+    """
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def upsert_game(self, path, game_record):
+        """Insert or replace a game from its record, as written by SimulationGame.record_game."""
+        header = game_record['header']
+        filename = os.path.basename(path)
+        experiment_hash = game_record.get('experiment_hash')
+        winner = header['winner']
+        stat = os.stat(path)
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (filename, path, stat.st_mtime, stat.st_size, experiment_hash, winner, header['winner_score'],
+                 header['max_turns'], len(header['creatures']), header['arena']['width'], header['arena']['height'],
+                 header.get('brain'), header.get('tick_mode')))
+            self.connection.execute("DELETE FROM creatures WHERE filename = ?", (filename,))
+            self.connection.executemany(
+                f"INSERT INTO creatures VALUES ({', '.join('?' * (7 + len(CREATURE_PARAMETERS)))})",
+                [(filename, creature['id'], experiment_hash, creature['name'], creature['name'].split(' ')[0],
+                  1 if creature['name'] == winner else 0, creature['score'],
+                  *(creature.get(parameter) for parameter in CREATURE_PARAMETERS))
+                 for creature in header['creatures']])
+
+    def upsert_experiment(self, batch_output, path=None):
+        """Insert or replace an experiment from a batch output, as written by save_batch_output."""
+        experiment_config = batch_output['experiment_config']
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO experiments VALUES (?, ?, ?, ?, ?, ?)",
+                (batch_output['experiment_hash'], batch_output['num_simulations'], experiment_config.get('time_limit'),
+                 json.dumps(experiment_config), json.dumps(batch_output['score_values']), path))
+
+    def is_current(self, path):
+        """Whether the catalog already holds this playback file, unchanged since it was added."""
+        row = self.connection.execute("SELECT path, file_mtime, file_size FROM games WHERE filename = ?",
+                                      (os.path.basename(path),)).fetchone()
+        if row is None or row['path'] != path:
+            return False
+        stat = os.stat(path)
+        return row['file_mtime'] == stat.st_mtime and row['file_size'] == stat.st_size
+
+    def backfill(self, playback_dir='playbacks', experiment_dir='experiments', prune=True, workers=None):
+        """Add the playbacks and batch outputs that are missing or changed, returns the number of games added.
+
+        Files already in the catalog are skipped by path, mtime and size, so
+        only new playbacks are parsed, on a pool of worker processes. A
+        playback that fails to parse is reported and left out. Games are keyed
+        by file name, so when several playbacks share a name only one is
+        cataloged and the others are reported. With prune, games whose file
+        is gone are removed.
+        """
+        paths_by_name = {}
+        for root, dirs, files in os.walk(playback_dir):
+            for file in files:
+                if is_playback_path(file) and 'AutoChessSimulationRun' in file:
+                    paths_by_name.setdefault(file, []).append(os.path.join(root, file))
+
+        paths = []
+        for file, candidates in sorted(paths_by_name.items()):
+            # Games are keyed by file name, so only one of several playbacks with the same name is cataloged:
+            # the one already in the catalog, otherwise the one closest to playback_dir
+            row = self.connection.execute("SELECT path FROM games WHERE filename = ?", (file,)).fetchone()
+            if row is not None and row['path'] in candidates:
+                path = row['path']
+            else:
+                path = min(candidates, key=lambda candidate: (candidate.count(os.sep), candidate))
+            if len(candidates) > 1:
+                print(f"Duplicate playback name {file}, cataloging {path} and skipping "
+                      f"{', '.join(candidate for candidate in candidates if candidate != path)}")
+            if not self.is_current(path):
+                paths.append(path)
+        errors = map_reduce(paths, read_game_record, self.upsert_game, workers)
+        added = len(paths) - len(errors)
+
+        for root, dirs, files in os.walk(experiment_dir):
+            for file in files:
+                if file.endswith('.json') and file.startswith('batch_output_'):
+                    path = os.path.join(root, file)
+                    with open(path, 'r') as f:
+                        self.upsert_experiment(json.load(f), path)
+
+        if prune:
+            missing = [(row['filename'],) for row in self.connection.execute("SELECT filename, path FROM games")
+                       if not os.path.exists(row['path'])]
+            with self.connection:
+                self.connection.executemany("DELETE FROM games WHERE filename = ?", missing)
+                self.connection.executemany("DELETE FROM creatures WHERE filename = ?", missing)
+        return added
+
+    def creature_statistics(self):
+        """One row per creature and game from the creatures table, with the columns of the creature statistics CSV."""
+        rows = self.connection.execute(
+            "SELECT filename AS game_filename, creature_id, is_winner AS winner, creature_type, speed, max_turn_rate, "
+            "damage, bullet_speed, shoot_cooldown, bullet_range, score, brake_cooldown, brake_power, experiment_hash "
+            "FROM creatures ORDER BY filename, creature_id")
+        return [dict(row) for row in rows]
+
+    def game_statistics(self):
+        """One row per game from the games table and its creatures, with the columns of the game statistics CSV."""
+        rows = self.connection.execute(
+            "SELECT g.filename, COUNT(*) AS num_creatures, SUM(c.score) AS total_score, "
+            "SUM(c.score) * 1.0 / COUNT(*) AS avg_score_per_player, g.winner, g.winner_score, g.max_turns, "
+            "MAX(c.score) AS max_score, g.experiment_hash "
+            "FROM games g JOIN creatures c ON c.filename = g.filename GROUP BY g.filename ORDER BY g.filename")
+        return [dict(row) for row in rows]
+
+    def experiments(self):
+        """Batch outputs of every experiment, in the format written by save_batch_output."""
+        rows = self.connection.execute("SELECT * FROM experiments ORDER BY experiment_hash")
+        return [{
+            'experiment_config': json.loads(row['experiment_config']),
+            'experiment_hash': row['experiment_hash'],
+            'score_values': json.loads(row['score_values']),
+            'num_simulations': row['num_simulations'],
+        } for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add existing playbacks and experiments to the SQLite catalog.')
+    parser.add_argument('-c', '--catalog', type=str, default=DEFAULT_CATALOG_PATH, help='Path to the catalog database.')
+    parser.add_argument('-p', '--playbacks', type=str, default='playbacks', help='Directory containing the playback files.')
+    parser.add_argument('-e', '--experiments', type=str, default='experiments', help='Directory containing the batch outputs.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, defaults to the number of CPUs.')
+
+    args = parser.parse_args()
+
+    catalog = PlaybackCatalog(args.catalog)
+    added = catalog.backfill(args.playbacks, args.experiments, workers=args.workers)
+    catalog.close()
+    print(f"Added {added} playbacks to {args.catalog}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# AutoChessDistributed.py
+
+import argparse
+import copy
+import gzip
+import json
+import multiprocessing
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from AutoChessBatchSimulation import AutoChessBatchedSimulator, load_experiment_config, generate_batch_filename
+from AutoChessPlaybackWriter import PlaybackWriter
+
+DEFAULT_PORT = 8765
+
+# Every message is a JSON header and an optional binary blob, each prefixed by its length
+MESSAGE_PREFIX = struct.Struct('!II')
+
+
+def send_message(sock, header, blob=b''):
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(MESSAGE_PREFIX.pack(len(data), len(blob)) + data + blob)
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def receive_message(sock):
+    """The next (header, blob) from sock, raises ConnectionError when the other side is gone."""
+    header_size, blob_size = MESSAGE_PREFIX.unpack(_receive_exactly(sock, MESSAGE_PREFIX.size))
+    header = json.loads(_receive_exactly(sock, header_size).decode('utf-8'))
+    return header, _receive_exactly(sock, blob_size) if blob_size else b''
+
+
+class BatchCoordinator:
+    """Hands out the games of a batch to workers over TCP and collects their playbacks.
+
+    A task is one (experiment config, seed, simulation number), so any
+    worker plays exactly the same game. A task is leased to one worker at a
+    time and handed out again when that worker disconnects or does not
+    answer within task_timeout seconds. The first result of a task wins,
+    a late duplicate is dropped. Playbacks are written and cataloged here,
+    through the simulator's background writer.
+    """
+    def __init__(self, simulator, num_simulations, first_simulation=1, seed=None, task_timeout=600):
+        self.simulator = simulator
+        self.num_simulations = num_simulations
+        self.task_timeout = task_timeout
+        rng = random.Random(seed)
+        self.seeds = {number: rng.getrandbits(32) for number in range(first_simulation, first_simulation + num_simulations)}
+        self.pending = deque(self.seeds)
+        self.leases = {}  # Simulation number to the deadline of its current worker
+        self.summaries = {}
+        self.writing = set()  # Simulation numbers whose playback is being handed to the writer
+        self.condition = threading.Condition()
+        # Workers run without a catalog, the coordinator owns it
+        self.worker_config = copy.deepcopy(simulator.experiment_config)
+        self.worker_config['catalog'] = ':memory:'
+
+    def next_task(self):
+        with self.condition:
+            now = time.monotonic()
+            for number, deadline in list(self.leases.items()):
+                if deadline < now:
+                    print(f"Simulation {number} timed out, handing it out again")
+                    del self.leases[number]
+                    self.pending.appendleft(number)
+            if self.pending:
+                number = self.pending.popleft()
+                self.leases[number] = now + self.task_timeout
+                return {'type': 'task', 'experiment_config': self.worker_config,
+                        'experiment_hash': self.simulator.experiment_hash,
+                        'simulation_number': number, 'seed': self.seeds[number]}
+            if self.leases:
+                # Everything is handed out, ask again in case a worker is lost
+                return {'type': 'wait', 'seconds': 1}
+            return {'type': 'done'}
+
+    def complete(self, number, summary, filename, blob):
+        with self.condition:
+            if number in self.summaries or number in self.writing or number not in self.seeds:
+                return
+            self.writing.add(number)
+        try:
+            # The game only counts as done once its playback is with the writer
+            game_record = json.loads(gzip.decompress(blob).decode('utf-8'))
+            self.simulator.playback_writer.write(f"playbacks/{filename}", game_record)
+        except BaseException:
+            with self.condition:
+                self.writing.discard(number)
+            raise
+        with self.condition:
+            self.writing.discard(number)
+            self.summaries[number] = summary
+            self.leases.pop(number, None)
+            if number in self.pending:
+                self.pending.remove(number)
+            self.condition.notify_all()
+
+    def release(self, numbers):
+        # The worker holding these is gone, they go back to the front of the queue
+        with self.condition:
+            for number in numbers:
+                if number in self.leases and number not in self.summaries:
+                    del self.leases[number]
+                    self.pending.appendleft(number)
+
+    def is_done(self):
+        return len(self.summaries) == self.num_simulations
+
+    def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        """Serve tasks until every game of the batch is back, returns their game_summary in order."""
+        coordinator = self
+
+        class WorkerHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                leased = set()
+                try:
+                    while True:
+                        header, blob = receive_message(self.request)
+                        if header['type'] == 'result':
+                            coordinator.complete(header['simulation_number'], header['summary'], header['filename'], blob)
+                            leased.discard(header['simulation_number'])
+                        task = coordinator.next_task()
+                        if task['type'] == 'task':
+                            leased.add(task['simulation_number'])
+                        send_message(self.request, task)
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    coordinator.release(leased)
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.simulator.playback_writer = PlaybackWriter(self.simulator.playback_writer_mode, self.simulator.playback_queue_size,
+                                                        self.simulator.catalog.path, self.simulator.fsync_playbacks)
+        server = Server((host, port), WorkerHandler)
+        server_thread = threading.Thread(target=server.serve_forever, name='coordinator', daemon=True)
+        server_thread.start()
+        print(f"Coordinator listening on {host}:{server.server_address[1]}, {self.num_simulations} simulations to run")
+        try:
+            with self.condition:
+                while not self.is_done():
+                    self.condition.wait(timeout=1)
+                    print(f"{len(self.summaries)} of {self.num_simulations} simulations done", end='\r')
+            print()
+        finally:
+            server.shutdown()
+            server.server_close()
+            self.simulator.playback_writer.close()
+            self.simulator.playback_writer = None
+        self.simulator.num_simulations_run = len(self.summaries)
+        return [self.summaries[number] for number in sorted(self.summaries)]
+
+
+def run_task(task):
+    """Play one task, returns the result header and the gzipped playback."""
+    simulator = AutoChessBatchedSimulator(task['experiment_config'])
+    try:
+        simulator.experiment_hash = task['experiment_hash']
+        random.seed(task['seed'])
+        summary = simulator.run_simulation(task['simulation_number'], record=False)
+        filename = generate_batch_filename(simulator.game.creature_counts, simulator.experiment_hash,
+                                           task['simulation_number'], simulator.playback_compression)
+        blob = gzip.compress(json.dumps(simulator.game.build_game_record()).encode('utf-8'), compresslevel=1)
+    finally:
+        simulator.catalog.close()
+    return {'type': 'result', 'simulation_number': task['simulation_number'], 'summary': summary,
+            'filename': filename}, blob
+
+
+def run_worker(host='127.0.0.1', port=DEFAULT_PORT, connect_timeout=30):
+    """Pull and play tasks until the coordinator is done, returns the number of games played."""
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            # The coordinator may not be up yet
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+    played = 0
+    with sock:
+        send_message(sock, {'type': 'request'})
+        while True:
+            try:
+                task, _ = receive_message(sock)
+            except ConnectionError:
+                break
+            if task['type'] == 'done':
+                break
+            if task['type'] == 'wait':
+                time.sleep(task['seconds'])
+                send_message(sock, {'type': 'request'})
+                continue
+            result, blob = run_task(task)
+            played += 1
+            send_message(sock, result, blob)
+    return played
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run AutoChess batches on workers spread over several machines.')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    coordinator_parser = subparsers.add_parser('coordinator', help='Hand out the games of a batch and collect the playbacks.')
+    coordinator_parser.add_argument('config', type=str, nargs='?', default='experiment_config.json', help='Path to the experiment configuration.')
+    coordinator_parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on, 0.0.0.0 for every interface.')
+    coordinator_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on.')
+    coordinator_parser.add_argument('--seed', type=int, help='Seed the per-game seeds are drawn from.')
+    coordinator_parser.add_argument('--task-timeout', type=float, default=600, help='Seconds before a game is handed to another worker.')
+    coordinator_parser.add_argument('-l', '--local-workers', type=int, default=0, help='Also start this many workers on this machine.')
+    worker_parser = subparsers.add_parser('worker', help='Play games handed out by a coordinator.')
+    worker_parser.add_argument('--host', type=str, default='127.0.0.1', help='Address of the coordinator.')
+    worker_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port of the coordinator.')
+
+    args = parser.parse_args()
+
+    if args.mode == 'worker':
+        played = run_worker(args.host, args.port)
+        print(f"Worker played {played} simulations")
+        return
+
+    experiment_config = load_experiment_config(args.config)
+    simulator = AutoChessBatchedSimulator(experiment_config)
+    coordinator = BatchCoordinator(simulator, experiment_config['num_simulations'], seed=args.seed,
+                                   task_timeout=args.task_timeout)
+    connect_host = '127.0.0.1' if args.host == '0.0.0.0' else args.host
+    local_workers = [multiprocessing.Process(target=run_worker, args=(connect_host, args.port))
+                     for _ in range(args.local_workers)]
+    for worker in local_workers:
+        worker.start()
+    summaries = coordinator.serve(args.host, args.port)
+    for worker in local_workers:
+        worker.join()
+
+    batch_output_file = "batch_output"
+    simulator.save_batch_output(batch_output_file, len(summaries), summaries[-1]['score_values'] if summaries else None)
+    print(f"Batch output saved to experiments/{batch_output_file}_<timestamp>.json")
+
+if __name__ == "__main__":
+    main()
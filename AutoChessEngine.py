@@ -1,8 +1,8 @@
 import json
 import math
 import random
-import pygame
-from collections import deque
+from collections import deque, OrderedDict
+from AutoChessPlaybackIO import save_playback
 import copy
 import copy
 
@@ -74,11 +74,80 @@ class Collider:
     def check_collision(self, other):
         raise NotImplementedError("This method should be implemented by subclasses.")
 
+def _round_half_away(value):
+    # pygame rounds floats given to Rect attributes half away from zero, unlike round()
+    if isinstance(value, int):
+        return value
+    rounded = math.trunc(value)
+    if abs(value - rounded) >= 0.5:
+        rounded += 1 if value > 0 else -1
+    return rounded
+
+
+class SimulationRect:
+    """Integer rectangle with the pygame.Rect behaviour the simulation relies on.
+
+    The simulation only needs bounds and containment, so it does not have
+    to import pygame. As with pygame.Rect, the constructor truncates floats
+    and the size and center setters round them half away from zero, so
+    games play out exactly as they did with pygame.Rect.
+    """
+    __slots__ = ('x', 'y', 'width', 'height')
+
+    def __init__(self, x, y, width, height):
+        self.x = int(x)
+        self.y = int(y)
+        self.width = int(width)
+        self.height = int(height)
+
+    @property
+    def left(self):
+        return self.x
+
+    @property
+    def top(self):
+        return self.y
+
+    @property
+    def right(self):
+        return self.x + self.width
+
+    @property
+    def bottom(self):
+        return self.y + self.height
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    @size.setter
+    def size(self, value):
+        self.width = _round_half_away(value[0])
+        self.height = _round_half_away(value[1])
+
+    @property
+    def center(self):
+        return (self.x + int(self.width / 2), self.y + int(self.height / 2))
+
+    @center.setter
+    def center(self, value):
+        self.x = _round_half_away(value[0]) - int(self.width / 2)
+        self.y = _round_half_away(value[1]) - int(self.height / 2)
+
+    def contains(self, other):
+        return (self.x <= other.x and self.y <= other.y
+                and self.right >= other.right and self.bottom >= other.bottom
+                and self.right > other.x and self.bottom > other.y)
+
+    def __repr__(self):
+        return f"SimulationRect({self.x}, {self.y}, {self.width}, {self.height})"
+
+
 class RectCollider(Collider):
     def __init__(self, center=(0, 0), size=(1, 1), angle=0, **kwargs):
         super().__init__(center, angle, **kwargs)  # Call the base class constructor first
         self._size = size  # Set the size attribute
-        self.rect = pygame.Rect(0, 0, *size)  # Initialize the rect attribute
+        self.rect = SimulationRect(0, 0, *size)  # Initialize the rect attribute
         self.rect.center = center  # Set the center of the rect
 
     @property
@@ -97,7 +166,7 @@ class RectCollider(Collider):
     @Collider.center.setter
     def center(self, value):
         Collider.center.fset(self, value)  # Set the center in the base class
-        self.rect.center = value  # Update the pygame.Rect object
+        self.rect.center = value  # Update the rect
 
 
     def get_vertices(self):
@@ -301,9 +370,30 @@ class PlaybackGameObject(GameObject):
         # This base method does nothing, and is here to ensure that the decorated setters
         # do not cause errors when called on a PlaybackCreature instance.
         pass
+
+    # Attributes replayed from deltaSetter events or updated while replaying. Private
+    # names are used so restoring a state bypasses the recordable setters.
+    playback_state_attributes = ('_health', '_score', '_is_braking', 'target', 'shoot_timer')
+
+    def get_playback_state(self):
+        """Capture the replayed state of the object, used for keyframes when seeking."""
+        # Centers replayed from events can be lists, the collider setter only takes tuples
+        state = {'center': tuple(self.collider.center), 'angle': self.collider.angle}
+        for attribute in self.playback_state_attributes:
+            if attribute in self.__dict__:
+                state[attribute] = self.__dict__[attribute]
+        return state
+
+    def set_playback_state(self, state):
+        self.collider.center = state['center']
+        self.collider.angle = state['angle']
+        for attribute in self.playback_state_attributes:
+            if attribute in state:
+                self.__dict__[attribute] = state[attribute]
     
     def move(self):
-        time_key = str(Game.get_time())
+        # Playback events are keyed by integer tick (see AutoChessPlayer.PlaybackEventIndex)
+        time_key = Game.get_time()
         if time_key in self.events:
             for event in self.events[time_key]:
                 if event["type"] == "deltaSetter":
@@ -381,6 +471,7 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
             self.original_speed = speed
             self.brake_timer = 0
             self._is_braking = False  # Initialize _is_braking attribute to False
+            self.blocked = False  # Set when the last move collided, makes the next think reverse
 
 
             self.events = events or {}
@@ -416,6 +507,10 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
             'brake_cooldown': self.brake_cooldown,
             'sprite_filename': self.sprite_filename,
             'score_values': self.game.score_values,  # Include the score_values from the game
+            # The fields above hold the state at the end of the game, these the state it started with
+            'initial_position': self.initial_position,
+            'initial_angle': self.initial_angle,
+            'max_health': self.max_health,
         }
 
     def take_damage(self, damage, attacker_id):
@@ -436,8 +531,8 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
     def find_nearest_creature(self):
         nearest_distance = float('inf')
         nearest_creature = None
-        for game_object in self.game.game_objects:
-            if isinstance(game_object, SimulationCreature) and game_object != self:
+        for game_object in self.game.creatures:
+            if game_object is not self:
                 distance = math.hypot(game_object.position[0] - self.position[0], game_object.position[1] - self.position[1])
                 if distance < nearest_distance:
                     nearest_creature = game_object
@@ -455,8 +550,8 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
         else:
             arena_center = (self.game.arena.width / 2, self.game.arena.height / 2)
             self.set_target(arena_center)
-        if ('blocked', None) in self.action_plan:
-            self.action_plan.remove(('blocked', None))
+        if self.blocked:
+            self.blocked = False
             self.action_plan.append(('reverse', None))
         # Example logic to add 'turn' action every turn and 'shoot' action if cooldown allows
         if self.target is not None:
@@ -464,7 +559,51 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
         if self.shoot_timer <= 0 and distance_to_target <= self.bullet_range:  # Can shoot if shoot_timer is 0 or less
             self.action_plan.append(('shoot', None))
             # print(f"{self.id} aiming!")
-            self.shoot_timer = self.shoot_cooldown  # Reset shoot cooldown timer
+            self.start_shoot_cooldown()
+
+    def apply_decision(self, target, brake, reverse, turn, shoot):
+        """Queue the actions a Brain decided for this creature, in the same order think() does."""
+        self.set_target(target)
+        if brake:
+            self.action_plan.append(('brake', None))
+        if reverse:
+            self.blocked = False
+            self.action_plan.append(('reverse', None))
+        self.action_plan.append(('turn', turn))
+        if shoot:
+            self.action_plan.append(('shoot', None))
+            self.start_shoot_cooldown()
+
+    # Cooldowns count down by one per move this creature makes. Instead of decrementing
+    # them in every move, the timers are worked out from the moves made since they were set.
+    moves_made = 0
+
+    @property
+    def shoot_timer(self):
+        return self._timer_left(self._shoot_timer)
+
+    @shoot_timer.setter
+    def shoot_timer(self, value):
+        self._shoot_timer = (value, self.moves_made)
+
+    @property
+    def brake_timer(self):
+        return self._timer_left(self._brake_timer)
+
+    @brake_timer.setter
+    def brake_timer(self, value):
+        self._brake_timer = (value, self.moves_made)
+
+    def _timer_left(self, timer):
+        value, set_at = timer
+        # A timer stops at 0, one that was set to 0 or less never counts down
+        return max(value - (self.moves_made - set_at), 0) if value > 0 else value
+
+    def start_shoot_cooldown(self):
+        self.shoot_timer = self.shoot_cooldown
+
+    def start_brake_cooldown(self):
+        self.brake_timer = self.brake_cooldown
             
     def calculate_turn(self, target):
         # Same target angle calculation as before, returns angle adjustment
@@ -525,7 +664,7 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
             # print(f"Creature {self.id} is braking. Current speed: {self.speed}")
             if abs(self.speed) < 5:  # Adjust the threshold as needed
                 self.speed = 0
-                self.brake_timer = self.brake_cooldown
+                self.start_brake_cooldown()
                 self.is_braking = False  # Set the braking state to False when speed is close to 0
                 # print(f"Creature {self.id} finished braking. Speed set to 0. Brake timer set to {self.brake_cooldown}")
         else:
@@ -545,12 +684,19 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
         # Create a copy of the collider for collision checking
         temp_collider.center = new_position
 
+        # Check for collisions with obstacles through the static layer
+        will_collide = self.game.static_geometry.collides(temp_collider)
+
         # Check for collisions with other creatures
-        will_collide = False
-        for other in self.game.game_objects:
+        for other in self.game.creatures:
             if other is not self and temp_collider.check_collision(other.collider):
                 will_collide = True
-                if isinstance(other, SimulationProjectile) and other.origin_id != self.id:
+
+        # Check for collisions with projectiles, only enemy ones deal damage
+        for other in self.game.projectiles:
+            if temp_collider.check_collision(other.collider):
+                will_collide = True
+                if other.origin_id != self.id:
                     self.take_damage(other.damage, other.origin_id)  # Pass the origin_id to take_damage
                     other.die()
                     # print(f"Collision detected between {self.id} and {other.id}")
@@ -558,8 +704,7 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
 
 
         # Check for collisions with arena walls
-        arena_bounds = pygame.Rect(0, 0, self.game.arena.width, self.game.arena.height)
-        if not arena_bounds.contains(temp_collider.rect):
+        if not self.game.static_geometry.arena_bounds.contains(temp_collider.rect):
             will_collide = True  # Set collision flag for arena boundary collision
 
         # If no collision is detected, update the actual position and collider
@@ -569,21 +714,77 @@ class SimulationCreature(SimulationGameObject, BaseCreature):
             self.position = new_position  # Update position if no collision
         else:
             # Handle collision (e.g., stop movement, bounce back, etc.)
-            # For now, we just clear the action plan to simulate stopping
+            # For now, we just clear the action plan and reverse on the next think
             self.action_plan.clear()
-            self.action_plan.append(('blocked', None))
-
-        # Decrement the shoot timer if it's greater than 0
-        if self.shoot_timer > 0:
-            self.shoot_timer -= 1
-
-            # Decrement the shoot timer if it's greater than 0
- 
-        if self.brake_timer > 0:
-            self.brake_timer -= 1
+            self.blocked = True
+
+        # Counts down shoot_timer and brake_timer
+        self.moves_made += 1
+
+
+class RenderCache:
+    """Surfaces reused across frames by the playback draw methods.
+
+    Fonts are created once per size. Rendered strings live in an LRU of
+    text_cache_size entries. Rotated surfaces are keyed by the source surface
+    and the angle rounded to angle_step degrees, so a sprite is rotated at
+    most 360 / angle_step times however many creatures use it.
+    """
+    def __init__(self, angle_step=1, text_cache_size=512):
+        self.angle_step = angle_step
+        self.text_cache_size = text_cache_size
+        self.fonts = {}  # size -> pygame.font.Font
+        self.texts = OrderedDict()  # (text, size, color) -> surface, least recently used first
+        self.scaled_surfaces = {}  # (surface, size) -> scaled surface
+        self.outlines = {}  # (size, color) -> transparent surface with a 1 pixel border
+        self.rotations = {}  # (surface, quantized angle) -> rotated surface
+
+    def font(self, size):
+        import pygame
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.Font(None, size)
+        return self.fonts[size]
+
+    def text(self, text, size, color):
+        key = (text, size, color)
+        surface = self.texts.get(key)
+        if surface is None:
+            surface = self.font(size).render(text, True, color)
+            self.texts[key] = surface
+            if len(self.texts) > self.text_cache_size:
+                self.texts.popitem(last=False)
+        else:
+            self.texts.move_to_end(key)
+        return surface
+
+    def scaled(self, surface, size):
+        import pygame
+        key = (surface, size)
+        if key not in self.scaled_surfaces:
+            self.scaled_surfaces[key] = pygame.transform.scale(surface, size)
+        return self.scaled_surfaces[key]
+
+    def outline(self, size, color):
+        import pygame
+        key = (size, color)
+        if key not in self.outlines:
+            outline_surface = pygame.Surface(size, pygame.SRCALPHA)
+            outline_surface.fill((0, 0, 0, 0))  # Fill with transparent color
+            pygame.draw.rect(outline_surface, color, outline_surface.get_rect(), 1)
+            self.outlines[key] = outline_surface
+        return self.outlines[key]
+
+    def rotated(self, surface, angle):
+        import pygame
+        quantized_angle = round(angle / self.angle_step) * self.angle_step % 360
+        key = (surface, quantized_angle)
+        if key not in self.rotations:
+            self.rotations[key] = pygame.transform.rotate(surface, quantized_angle)
+        return self.rotations[key]
 
 
 def draw_rotated_box(screen, rect, angle, color):
+        import pygame
         # Calculate the angle in radians
         radians = math.radians(angle)
         
@@ -612,8 +813,7 @@ class PlaybackCreature(PlaybackGameObject, BaseCreature):
         # Load the image only once in the constructor
 
         #self.image = pygame.image.load('assets/car1.png').convert_alpha()
-        self.sprite = sprite
-        self.sprite = pygame.transform.scale(self.sprite, self.collider.size)  # Scale to match the collider size
+        self.sprite = sprite  # Scaled to the collider size by the render cache, shared with same-sized creatures
 
         self._is_braking = False  # Initialize _is_braking attribute to False
 
@@ -627,13 +827,18 @@ class PlaybackCreature(PlaybackGameObject, BaseCreature):
 
 
     def draw(self, screen, convert_to_screen):
+        import pygame
         # Convert the collider's center to screen coordinates
         screen_center = convert_to_screen(self.collider.center)
 
+        render_cache = self.game.render_cache
+        drawn = []  # Screen areas touched, returned for dirty-rectangle updates
+
         # Draw the sprite
-        rotated_sprite = pygame.transform.rotate(self.sprite, -self.angle + 90)
+        sprite = render_cache.scaled(self.sprite, self.collider.size)  # Scale to match the collider size
+        rotated_sprite = render_cache.rotated(sprite, -self.angle + 90)
         new_rect = rotated_sprite.get_rect(center=screen_center)
-        screen.blit(rotated_sprite, new_rect.topleft)
+        drawn.append(screen.blit(rotated_sprite, new_rect.topleft))
         
 
         # Draw the triangle pointer
@@ -645,20 +850,16 @@ class PlaybackCreature(PlaybackGameObject, BaseCreature):
         left_point = (back_center_point[0] + math.cos(radians + math.pi / 2) * (base_length / 2), back_center_point[1] + math.sin(radians + math.pi / 2) * (base_length / 2))
         right_point = (back_center_point[0] + math.cos(radians - math.pi / 2) * (base_length / 2), back_center_point[1] + math.sin(radians - math.pi / 2) * (base_length / 2))
         triangle_points = [front_point, left_point, right_point]
-        pygame.draw.polygon(screen, self.color, triangle_points)
+        drawn.append(pygame.draw.polygon(screen, self.color, triangle_points))
 
         if self.game.show_bounding_boxes:
-            # Create a surface for the bounding box with the same size as the collider
-            bbox_surface = pygame.Surface(self.collider.size, pygame.SRCALPHA)
-            bbox_surface.fill((0, 0, 0, 0))  # Fill with transparent color
-            pygame.draw.rect(bbox_surface, self.color, bbox_surface.get_rect(), 1)
-            # Apply the same transformations as the sprite: scale and rotate
-            #scaled_bbox_surface = pygame.transform.scale(bbox_surface, self.scale_size(self.collider.size))
-            rotated_bbox_surface = pygame.transform.rotate(bbox_surface, -self.angle + 90)
+            # A surface for the bounding box with the same size as the collider, rotated like the sprite
+            bbox_surface = render_cache.outline(self.collider.size, self.color)
+            rotated_bbox_surface = render_cache.rotated(bbox_surface, -self.angle + 90)
 
             # Use the same center as the sprite for positioning
             bbox_rect = rotated_bbox_surface.get_rect(center=screen_center)
-            screen.blit(rotated_bbox_surface, bbox_rect.topleft)
+            drawn.append(screen.blit(rotated_bbox_surface, bbox_rect.topleft))
 
         if self.game.draw_shooting_ranges:
             screen_center = convert_to_screen(self.collider.center)
@@ -673,7 +874,7 @@ class PlaybackCreature(PlaybackGameObject, BaseCreature):
 
 
             # Draw the arc representing the shooting cooldown
-            pygame.draw.arc(screen, self.color, pygame.Rect(screen_center[0] - screen_bullet_range, screen_center[1] - screen_bullet_range, screen_bullet_range * 2, screen_bullet_range * 2), 0, math.radians(arc_angle), width=1)
+            drawn.append(pygame.draw.arc(screen, self.color, pygame.Rect(screen_center[0] - screen_bullet_range, screen_center[1] - screen_bullet_range, screen_bullet_range * 2, screen_bullet_range * 2), 0, math.radians(arc_angle), width=1))
 
         
         health_bar_height = 3 # Height of the health bar
@@ -684,28 +885,23 @@ class PlaybackCreature(PlaybackGameObject, BaseCreature):
             health_ratio = 0
         health_bar_color = (0, 255, 0) if health_ratio > 0.5 else (255, 255, 0) if health_ratio > 0.25 else (255, 0, 0) # Change color based on health
 
-        pygame.draw.rect(screen, health_bar_color, (screen_center[0] - health_bar_width / 2, screen_center[1] - health_bar_height - 10, health_bar_width * health_ratio, health_bar_height))
+        drawn.append(pygame.draw.rect(screen, health_bar_color, (screen_center[0] - health_bar_width / 2, screen_center[1] - health_bar_height - 10, health_bar_width * health_ratio, health_bar_height)))
                 
         # Draw the score above the creature's head
         score_text = str(self.score)
-        score_font = pygame.font.Font(None, 24)  # Adjust the font size as needed
-        score_surface = score_font.render(score_text, True, (255, 255, 255))  # White color
+        score_surface = render_cache.text(score_text, 24, (255, 255, 255))  # White, adjust the font size as needed
         score_rect = score_surface.get_rect(center=(screen_center[0], screen_center[1] - 30))  # Adjust the vertical position as needed
-        screen.blit(score_surface, score_rect)
+        drawn.append(screen.blit(score_surface, score_rect))
 
         # Draw the "brake!" text under the creature when braking
         if self.is_braking:
             brake_text = "brake!"
-            brake_font = pygame.font.Font(None, 18)  # Adjust the font size as needed (smaller than score)
             brake_color = (255, 0, 0)  # Red color
-            brake_surface = brake_font.render(brake_text, True, brake_color)
+            brake_surface = render_cache.text(brake_text, 18, brake_color)  # Smaller than score
             brake_rect = brake_surface.get_rect(center=(screen_center[0], screen_center[1] + 30))  # Adjust the vertical position as needed
-            screen.blit(brake_surface, brake_rect)
-
+            drawn.append(screen.blit(brake_surface, brake_rect))
 
-        # Because this timer is only used for drawing, it doesn't need to be updated in the move method
-        if self.shoot_timer < self.shoot_cooldown:
-            self.shoot_timer += 1
+        return drawn[0].unionall(drawn[1:])
 
 
 
@@ -759,6 +955,27 @@ class SimulationProjectile(SimulationGameObject, BaseProjectile):
         # Move the print statement after the id has been assigned
         # print(f"Projectile {self.id} created!")
         self.start_position = position
+
+        # The move on which the range runs out is known at creation, so move() only counts
+        self.moves_made = 0
+        self.out_of_range_move = self.moves_until_out_of_range()
+
+    def moves_until_out_of_range(self):
+        """Number of moves after which the distance run first exceeds the range, None if never."""
+        if self.speed == 0:
+            return None if self.range >= 0 else 1
+        # Step the same float arithmetic as move() so the expiry lands on the same move
+        radians = math.radians(self.angle)
+        dx = math.cos(radians) * self.speed
+        dy = math.sin(radians) * self.speed
+        x, y = self.start_position
+        moves = 0
+        distance_run = 0
+        while distance_run <= self.range:
+            x, y = x + dx, y + dy
+            moves += 1
+            distance_run = math.sqrt((x - self.start_position[0])**2 + (y - self.start_position[1])**2)
+        return moves
     
     def set_color_from_origin(self, game):
         # Retrieve the origin creature using the game's get_game_object_by_id method
@@ -783,15 +1000,13 @@ class SimulationProjectile(SimulationGameObject, BaseProjectile):
         new_y = self.position[1] + dy
         new_position = (new_x, new_y)
 
-        # Check if the distance between start_position and new_position is larger than the bullet's range
-        distance_run = math.sqrt((new_position[0] - self.start_position[0])**2 + (new_position[1] - self.start_position[1])**2)
-        
-        if distance_run > self.range:
+        # Dies on the move where the distance run exceeds the bullet's range
+        self.moves_made += 1
+        if self.moves_made == self.out_of_range_move:
             self.die()
 
         # Check for collisions with the arena walls
-        arena_bounds = pygame.Rect(0, 0, self.game.arena.width, self.game.arena.height)
-        if not arena_bounds.contains(self.collider.rect):
+        if not self.game.static_geometry.arena_bounds.contains(self.collider.rect):
             # If the projectile is outside the arena, it dies
             self.die()
             return
@@ -799,16 +1014,15 @@ class SimulationProjectile(SimulationGameObject, BaseProjectile):
         # Update the position if no collision with the arena walls
         self.position = new_position
 
-        # Check for collisions with other game objects
-        for game_object in self.game.game_objects:
-            if isinstance(game_object, SimulationProjectile):
-                if self.collider.check_collision(game_object.collider) and self.origin_id != game_object.origin_id and self.id != game_object.id:
-                    game_object.die()
-                    self.die()
-            elif isinstance(game_object, SimulationCreature):
-                if self.collider.check_collision(game_object.collider) and self.origin_id != game_object.id and self.id != game_object.id:
-                    game_object.take_damage(self.damage, self.origin_id)  # Pass the origin_id as the attacker_id
-                    self.die()
+        # Check for collisions with creatures and other projectiles
+        for creature in self.game.creatures:
+            if self.collider.check_collision(creature.collider) and self.origin_id != creature.id:
+                creature.take_damage(self.damage, self.origin_id)  # Pass the origin_id as the attacker_id
+                self.die()
+        for projectile in self.game.projectiles:
+            if self.collider.check_collision(projectile.collider) and self.origin_id != projectile.origin_id and self.id != projectile.id:
+                projectile.die()
+                self.die()
 
     
     @property
@@ -833,6 +1047,86 @@ class Obstacle(SimulationGameObject):
     def move(self):
         pass
 
+
+class StaticGeometry:
+    """Acceleration structure for the static parts of a SimulationGame.
+
+    Obstacles never move, so their OBB data (vertices, axes and projections
+    onto their own axes) is computed once, and their bounding boxes are
+    rasterized into a uniform grid. A query only runs SAT against the
+    obstacles that share a grid cell with the query box.
+    """
+    def __init__(self, arena, obstacles, cell_size=100):
+        self.arena_bounds = SimulationRect(0, 0, arena.width, arena.height)
+        self.cell_size = cell_size
+        self.entries = []  # (obstacle, vertices, axes, projections, bounds)
+        self.grid = {}  # (cell_x, cell_y) -> indices into entries
+
+        for obstacle in obstacles:
+            collider = obstacle.collider
+            vertices = collider.get_vertices()
+            axes = collider._get_obb_axes()
+            projections = [collider._project_onto_axis(vertices, axis) for axis in axes]
+            bounds = self._bounds(vertices)
+            for cell in self._cells(bounds):
+                self.grid.setdefault(cell, []).append(len(self.entries))
+            self.entries.append((obstacle, vertices, axes, projections, bounds))
+
+    @staticmethod
+    def _bounds(vertices):
+        xs = [vertex[0] for vertex in vertices]
+        ys = [vertex[1] for vertex in vertices]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def _cells(self, bounds):
+        min_x, min_y, max_x, max_y = bounds
+        for cell_x in range(math.floor(min_x / self.cell_size), math.floor(max_x / self.cell_size) + 1):
+            for cell_y in range(math.floor(min_y / self.cell_size), math.floor(max_y / self.cell_size) + 1):
+                yield (cell_x, cell_y)
+
+    def _hits(self, collider):
+        vertices = collider.get_vertices()
+        bounds = self._bounds(vertices)
+
+        candidates = set()
+        for cell in self._cells(bounds):
+            candidates.update(self.grid.get(cell, ()))
+        if not candidates:
+            return
+
+        axes = collider._get_obb_axes()
+        own_projections = [collider._project_onto_axis(vertices, axis) for axis in axes]
+        for index in sorted(candidates):
+            obstacle, obstacle_vertices, obstacle_axes, obstacle_projections, obstacle_bounds = self.entries[index]
+            # Disjoint bounding boxes can never hold overlapping OBBs
+            if (bounds[2] < obstacle_bounds[0] or obstacle_bounds[2] < bounds[0] or
+                    bounds[3] < obstacle_bounds[1] or obstacle_bounds[3] < bounds[1]):
+                continue
+
+            Game.increment_collision_checks()
+            if self._separated(own_projections, obstacle_vertices, axes, collider):
+                continue
+            if self._separated(obstacle_projections, vertices, obstacle_axes, collider):
+                continue
+            yield obstacle
+
+    @staticmethod
+    def _separated(projections, vertices, axes, collider):
+        for (own_min, own_max), axis in zip(projections, axes):
+            other_min, other_max = collider._project_onto_axis(vertices, axis)
+            if own_max < other_min or other_max < own_min:
+                return True
+        return False
+
+    def query(self, collider):
+        """Return every obstacle overlapping the given RectCollider."""
+        return list(self._hits(collider))
+
+    def collides(self, collider):
+        """Check whether the given RectCollider overlaps any obstacle."""
+        return next(self._hits(collider), None) is not None
+
+
 class PlaybackObstacle(PlaybackGameObject):
     def __init__(self, playback_id, position, angle, size, scale_size, scale_position):
         super().__init__(playback_id, position, angle)
@@ -841,6 +1135,7 @@ class PlaybackObstacle(PlaybackGameObject):
         self.scale_position = scale_position
 
     def draw(self, screen, convert_to_screen):
+        import pygame
         # Convert the position to screen coordinates
         screen_position = convert_to_screen(self.position)
 
@@ -856,7 +1151,7 @@ class PlaybackObstacle(PlaybackGameObject):
         rotated_rect = rotated_surface.get_rect(center=screen_position)
 
         # Draw the rotated obstacle
-        screen.blit(rotated_surface, rotated_rect)
+        return screen.blit(rotated_surface, rotated_rect)
 
         
 
@@ -871,8 +1166,11 @@ class PlaybackProjectile(PlaybackGameObject, BaseProjectile):
         if collider is not None:
             self.collider = collider
         self.start_position = position
+        self.rect_angle = None  # Angle the cached rect size was computed for
+        self.rect_size = None
 
     def draw(self, screen, convert_to_screen=None):
+            import pygame
 
             # Convert the position to screen coordinates if necessary
             if convert_to_screen:
@@ -883,14 +1181,18 @@ class PlaybackProjectile(PlaybackGameObject, BaseProjectile):
             # Draw the trail
             if self.start_position: # Assuming start_position is a class attribute
                 start_position_screen = convert_to_screen(self.start_position) if convert_to_screen else self.start_position
-                pygame.draw.line(screen, (255, 255, 255), start_position_screen, screen_position, 1) # Draw a white line
-            # Create the rectangle at origin, then rotate and move to the correct position
-            unrotated_rect = pygame.Rect(0, 0, *self.collider.size)
-            rotated_rect = pygame.transform.rotate(pygame.Surface(unrotated_rect.size), -self.angle).get_rect()
+                trail_rect = pygame.draw.line(screen, (255, 255, 255), start_position_screen, screen_position, 1) # Draw a white line
+            # The rotated rectangle only changes with the angle, which is fixed for most of the flight
+            if self.rect_angle != self.angle:
+                unrotated_rect = pygame.Rect(0, 0, *self.collider.size)
+                self.rect_size = pygame.transform.rotate(pygame.Surface(unrotated_rect.size), -self.angle).get_size()
+                self.rect_angle = self.angle
+            rotated_rect = pygame.Rect((0, 0), self.rect_size)
             rotated_rect.center = screen_position
 
             # Draw the rectangle
-            pygame.draw.rect(screen, self.color, rotated_rect)
+            drawn_rect = pygame.draw.rect(screen, self.color, rotated_rect)
+            return drawn_rect.union(trail_rect) if self.start_position else drawn_rect
 
 #TODO make Game proper singleton and remove the self.game references
 class Game:
@@ -916,6 +1218,10 @@ class Game:
     def reset_time(cls):
         cls._time = 0
 
+    @classmethod
+    def set_time(cls, value):
+        cls._time = value
+
     @classmethod
     def increment_collision_checks(cls):
         """Increment the static collision check counter."""
@@ -964,6 +1270,18 @@ class Game:
 
 
 # Example of converting a complex object to a serializable format
+def write_game_record(filename, game_record, catalog=None, fsync=False):
+    """Save a game record as a playback, and index it in the catalog when one is given.
+
+    A filename ending in .json.gz or .json.xz is written compressed.
+    """
+    save_playback(filename, game_record, fsync)
+
+    # Index the header, so statistics never have to parse the events again
+    if catalog is not None:
+        catalog.upsert_game(filename, game_record)
+
+
 def serialize_events(events):
     serialized_events = {}
     for time_index, event_list in events.items():
@@ -994,14 +1312,34 @@ def serialize_events(events):
     return serialized_events
 
 
+TICK_MODES = ("interleaved", "two_phase")
+
+
 class SimulationGame(Game):
-    def __init__(self, arena, creatures=None, experiment_hash=None):
+    def __init__(self, arena, creatures=None, experiment_hash=None, brain=None, tick_mode="interleaved",
+                 think_executor=None, think_workers=1, parallel_think_threshold=64):
         super().__init__(arena)
-        self.game_objects = creatures
+        initial_objects = creatures if creatures is not None else []
+        # Obstacles stay out of game_objects, the static layer handles them
+        self.game_objects = [obj for obj in initial_objects if not isinstance(obj, Obstacle)]
         self.creature_counts = {}
         self.id_counter = 1
+
+        # Typed registries, kept in sync with game_objects by add/remove_game_object
+        self.creatures = []
+        self.projectiles = []
+        self.obstacles = []
+        self.fallen_creatures = []
+        for game_object in initial_objects:
+            self._registry_for(game_object).append(game_object)
+        self.objects_by_id = {}
+        self._static_geometry = None
+
         if creatures:
             self.set_game_for_creatures()
+            for obstacle in self.obstacles:
+                obstacle.set_game(self)
+            self.objects_by_id = {obj.id: obj for obj in self.game_objects}
         self.score_values = {
             "hit_taken": -2,
             "hit_given": 5,
@@ -1009,6 +1347,20 @@ class SimulationGame(Game):
             "kill": 30,
         }
         self.experiment_hash = experiment_hash  # Store the experiment_hash
+        # Optional Brain (see AutoChessBrain) deciding for all creatures at once,
+        # when None every creature runs its own think()
+        self.brain = brain
+
+        # "interleaved": each object thinks then moves, seeing the moves made before it this tick.
+        # "two_phase": every creature thinks against the same frozen tick, then all objects
+        # move in id order. The brain's think phase can then be split over think_executor
+        # (a concurrent.futures executor) once there are parallel_think_threshold creatures.
+        if tick_mode not in TICK_MODES:
+            raise ValueError(f"Unknown tick mode '{tick_mode}'. Expected one of: {', '.join(TICK_MODES)}")
+        self.tick_mode = tick_mode
+        self.think_executor = think_executor
+        self.think_workers = think_workers
+        self.parallel_think_threshold = parallel_think_threshold
         
     def generate_id(self):
         """Generate a new unique ID."""
@@ -1016,10 +1368,47 @@ class SimulationGame(Game):
         self.id_counter += 1
         return new_id
 
+    def _registry_for(self, obj):
+        if isinstance(obj, SimulationCreature):
+            return self.creatures
+        if isinstance(obj, SimulationProjectile):
+            return self.projectiles
+        if isinstance(obj, Obstacle):
+            return self.obstacles
+        return []  # Untyped objects only live in game_objects
+
+    @property
+    def creature_count(self):
+        """Number of creatures still alive, dead ones leave the registry."""
+        return len(self.creatures)
+
+    @property
+    def projectile_count(self):
+        return len(self.projectiles)
+
+    @property
+    def obstacle_count(self):
+        return len(self.obstacles)
+
+    @property
+    def static_geometry(self):
+        """Static obstacle layer, built on first use after the obstacles are placed."""
+        if self._static_geometry is None:
+            self._static_geometry = StaticGeometry(self.arena, self.obstacles)
+        return self._static_geometry
+
+    def get_game_object_by_id(self, object_id):
+        return self.objects_by_id.get(object_id)
+
     def remove_game_object(self, obj):
         if obj in self.game_objects:
             self.cemetery.append(obj)
             self.game_objects.remove(obj)
+            del self.objects_by_id[obj.id]
+            registry = self._registry_for(obj)
+            registry.remove(obj)
+            if registry is self.creatures:
+                self.fallen_creatures.append(obj)
 
     def simulate_turn(self):
         if Game.get_time() == -1:
@@ -1027,31 +1416,78 @@ class SimulationGame(Game):
         # print(f"===T: {Game.get_time()} ========")
         # print(f"Collision checks: {Game._collision_checks}")
         Game.reset_collision_checks() 
-        for game_object in self.game_objects:
-            game_object.think()  # Let each creature decide its move
-            game_object.move()
+        if self.tick_mode == "two_phase":
+            self._think_phase()
+            self._move_phase()
+        elif self.brain is not None:
+            # Every creature decides from the same snapshot at the start of the tick
+            self.brain.think_all(self)
+            for game_object in self.game_objects:
+                game_object.move()
+        else:
+            for game_object in self.game_objects:
+                game_object.think()  # Let each creature decide its move
+                game_object.move()
         Game.update_time()  # Increment the time after all creatures have moved
 
+    def _think_phase(self):
+        # Nothing moves during this phase, so every creature sees the same tick
+        if self.brain is not None:
+            parallel = self.think_executor is not None and self.creature_count >= self.parallel_think_threshold
+            if parallel:
+                self.brain.think_all(self, self.think_executor, self.think_workers)
+            else:
+                self.brain.think_all(self)
+        else:
+            for creature in self.creatures:
+                creature.think()
+
+    def _move_phase(self):
+        # Objects move in id order. Objects removed earlier in the phase are skipped
+        # without shifting anyone else's turn, and projectiles created during the
+        # phase move after everything else, like in the interleaved mode.
+        last_id = 0
+        while True:
+            movers = [obj for obj in self.game_objects if obj.id > last_id]
+            if not movers:
+                break
+            last_id = movers[-1].id
+            for game_object in movers:
+                if self.objects_by_id.get(game_object.id) is game_object:
+                    game_object.move()
+
     def add_game_object(self, object):
         object._internal_id = self.generate_id()
-        object = super().add_game_object(object)
+        if isinstance(object, Obstacle):
+            # Obstacles never think or move, so they skip the per-tick loop
+            object.set_game(self)
+            self.obstacles.append(object)
+            self._static_geometry = None
+            return
+        super().add_game_object(object)
+        self.objects_by_id[object.id] = object
+        self._registry_for(object).append(object)
+
 
 
+    def record_game(self, filename, catalog=None):
+        write_game_record(filename, self.build_game_record(), catalog)
 
-    def record_game(self, filename):
-        # Bring the cemetery back for recording
-        self.game_objects.extend([obj for obj in self.cemetery if isinstance(obj, BaseCreature)])
+    def build_game_record(self):
+        """The playback of this game as a dict of plain values, ready to be written."""
+        # Bring the fallen creatures back for recording
+        all_creatures = self.creatures + self.fallen_creatures
 
         # Serialize the creatures
-        creatures_data = [creature.to_dict() for creature in self.game_objects if isinstance(creature, SimulationCreature)]
+        creatures_data = [creature.to_dict() for creature in all_creatures]
 
         # Serialize the events
         events = serialize_events(self.global_events)
 
         winner_creature = None
         if self.winner:
-            for creature in self.game_objects:
-                if isinstance(creature, SimulationCreature) and creature.name == self.winner:
+            for creature in all_creatures:
+                if creature.name == self.winner:
                     winner_creature = creature
                     break
 
@@ -1063,7 +1499,7 @@ class SimulationGame(Game):
             'angle': obstacle.angle,
             'size': obstacle.collider.size,
         }
-        for obstacle in self.game_objects if isinstance(obstacle, Obstacle)]
+        for obstacle in self.obstacles]
 
         max_turns = max(self.global_events.keys()) if self.global_events else 0
         game_record = {
@@ -1075,17 +1511,12 @@ class SimulationGame(Game):
                 "creatures": creatures_data,  # Include the serialized creatures
                 "score_values": self.score_values,  # Include the score_values dictionary
                 "obstacles": obstacles_data,  # Include the serialized obstacles
+                "brain": self.brain.name if self.brain else None,  # None means per-creature think()
+                "tick_mode": self.tick_mode,  # How think and move were ordered within a tick
             },
             "experiment_hash": self.experiment_hash,  # Include the experiment_hash
             "events": events,
         }
-
-        # Save the game record to a JSON file
-        with open(filename, 'w') as f:
-            json.dump(game_record, f, indent=4)
-
-        # Save the game record to a JSON file
-        with open(filename, 'w') as f:
-            json.dump(game_record, f, indent=4)
+        return game_record
 
 
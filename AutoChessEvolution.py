@@ -0,0 +1,263 @@
+# AutoChessEvolution.py
+
+import argparse
+import copy
+import glob
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from AutoChessBatchSimulation import AutoChessBatchedSimulator, load_experiment_config, creature_type_of
+
+# Parameters drawn by create_creature from a "<gene>_range" of the creature config
+INTEGER_GENES = ['speed', 'max_turn_rate', 'shoot_cooldown', 'damage', 'bullet_speed', 'bullet_range', 'brake_cooldown']
+FLOAT_GENES = ['brake_power']
+GENES = INTEGER_GENES + FLOAT_GENES
+
+
+def clip_gene(gene, value, bounds):
+    low, high = bounds[gene]
+    value = min(max(value, low), high)
+    return int(round(value)) if gene in INTEGER_GENES else value
+
+
+def random_individual(bounds, rng):
+    return {gene: clip_gene(gene, rng.uniform(*bounds[gene]), bounds) for gene in GENES}
+
+
+def crossover(parent_a, parent_b, rng):
+    # Uniform crossover, every gene comes from either parent
+    return {gene: parent_a[gene] if rng.random() < 0.5 else parent_b[gene] for gene in GENES}
+
+
+def mutate(individual, bounds, rng, mutation_rate, mutation_scale):
+    # Gaussian steps scaled to the width of each gene's bounds
+    mutated = dict(individual)
+    for gene in GENES:
+        if rng.random() < mutation_rate:
+            low, high = bounds[gene]
+            mutated[gene] = clip_gene(gene, mutated[gene] + rng.gauss(0, mutation_scale * (high - low)), bounds)
+    return mutated
+
+
+def fixed_creature_config(base_creature_config, parameters):
+    """A creature config whose creatures all get the given parameter values, the others keep their ranges.
+
+    create_creature draws every parameter from a range, so concrete values
+    are given as ranges of a single value.
+    """
+    creature_config = copy.deepcopy(base_creature_config)
+    for parameter, value in parameters.items():
+        creature_config[f"{parameter}_range"] = [value, value]
+    return creature_config
+
+
+def game_experiment_config(base_config, creature_type, individuals):
+    """An experiment with one creature per individual, named ind<index> after its place in the population."""
+    experiment_config = copy.deepcopy(base_config)
+    base_creature_config = base_config['creature_config'][creature_type]
+    experiment_config['creature_config'] = {}
+    for index, genes in individuals:
+        experiment_config['creature_config'][f"ind{index}"] = fixed_creature_config(base_creature_config, genes)
+    experiment_config['creature_types'] = [f"ind{index}" for index, genes in individuals]
+    experiment_config['num_creatures'] = [1] * len(individuals)
+    return experiment_config
+
+
+def run_game(experiment_config, seed, simulation_number=1, record=False, details=None):
+    """Play one game in a worker process, returns its game_summary. The seed makes the game repeatable."""
+    simulator = AutoChessBatchedSimulator(experiment_config)
+    try:
+        random.seed(seed)
+        summary = simulator.run_simulation(simulation_number, record)
+        if record:
+            simulator.save_batch_output(f"batch_output_{simulator.experiment_hash}", 1, details=details)
+        return summary
+    finally:
+        simulator.catalog.close()
+
+
+class EvolutionaryTournament:
+    """Genetic algorithm over concrete creature parameter vectors.
+
+    Every generation, the population is shuffled into games of
+    creatures_per_game individuals, games_per_individual times, and the
+    games run on a process pool. The fitness of an individual is its mean
+    score plus win_bonus times its win rate. The next generation keeps the
+    elite best individuals and fills the rest with tournament selection,
+    uniform crossover and Gaussian mutation. Genes are bounded by the
+    ranges of creature_type in the base experiment config.
+
+    Games are not recorded unless record is "all". With "best", the game
+    where the best individual of a generation scored the most is played
+    again from its seed and recorded. Every generation is checkpointed, and
+    a run started again with the same output_dir resumes after the last one.
+    """
+    def __init__(self, evolution_config, output_dir=None):
+        self.evolution_config = evolution_config
+        self.base_config = load_experiment_config(evolution_config.get('base_config', 'experiment_config.json'))
+        self.creature_type = evolution_config.get('creature_type', self.base_config['creature_types'][0])
+        creature_config = self.base_config['creature_config'][self.creature_type]
+        self.bounds = {gene: tuple(evolution_config.get('bounds', {}).get(gene, creature_config[f"{gene}_range"]))
+                       for gene in GENES}
+        self.population_size = evolution_config.get('population_size', 16)
+        self.generations = evolution_config.get('generations', 10)
+        self.creatures_per_game = evolution_config.get('creatures_per_game', 4)
+        self.games_per_individual = evolution_config.get('games_per_individual', 3)
+        self.elite = evolution_config.get('elite', 2)
+        self.tournament_size = evolution_config.get('tournament_size', 3)
+        self.crossover_rate = evolution_config.get('crossover_rate', 0.9)
+        self.mutation_rate = evolution_config.get('mutation_rate', 0.2)
+        self.mutation_scale = evolution_config.get('mutation_scale', 0.1)
+        self.win_bonus = evolution_config.get('win_bonus', 50)
+        self.record = evolution_config.get('record', 'best')  # "none", "best" or "all"
+        self.seed = evolution_config.get('seed', 0)
+        self.output_dir = output_dir or os.path.join(
+            'experiments', f"evolution_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    def generation_rng(self, generation):
+        # One generator per generation, so a resumed run breeds the same individuals
+        return random.Random(f"{self.seed}-{generation}")
+
+    def checkpoint_path(self, generation):
+        return os.path.join(self.output_dir, f"generation_{generation:04d}.json")
+
+    def load_last_checkpoint(self):
+        paths = sorted(glob.glob(os.path.join(self.output_dir, 'generation_*.json')))
+        if not paths:
+            return None
+        with open(paths[-1], 'r') as f:
+            return json.load(f)
+
+    def schedule_games(self, population, rng):
+        """Groups of population indices, every individual is in games_per_individual of them."""
+        games = []
+        for _ in range(self.games_per_individual):
+            order = list(range(len(population)))
+            rng.shuffle(order)
+            games.extend(order[start:start + self.creatures_per_game]
+                         for start in range(0, len(order), self.creatures_per_game))
+        # A lone individual left over has no one to fight
+        return [game for game in games if len(game) > 1]
+
+    def evaluate(self, executor, generation, population, rng):
+        """Play the games of a generation, returns the fitness of every individual and the games played."""
+        games = []
+        futures = []
+        for number, indices in enumerate(self.schedule_games(population, rng)):
+            experiment_config = game_experiment_config(self.base_config, self.creature_type,
+                                                       [(index, population[index]) for index in indices])
+            seed = rng.getrandbits(32)
+            details = {'evolution': {'output_dir': self.output_dir, 'generation': generation}}
+            games.append({'individuals': indices, 'seed': seed})
+            futures.append(executor.submit(run_game, experiment_config, seed, number + 1,
+                                           self.record == 'all', details))
+
+        scores = [[] for _ in population]
+        wins = [0] * len(population)
+        for game, future in zip(games, futures):
+            summary = future.result()
+            game['winner'] = summary['winner']
+            game['scores'] = {}
+            for name, score in summary['scores'].items():
+                index = int(creature_type_of(name)[len('ind'):])
+                scores[index].append(score)
+                game['scores'][index] = score
+            if summary['winner']:
+                wins[int(creature_type_of(summary['winner'])[len('ind'):])] += 1
+
+        fitness = []
+        for index in range(len(population)):
+            played = len(scores[index])
+            fitness.append(sum(scores[index]) / played + self.win_bonus * wins[index] / played if played else 0.0)
+        return fitness, games
+
+    def breed(self, population, fitness, rng):
+        ranked = sorted(range(len(population)), key=lambda index: fitness[index], reverse=True)
+        next_population = [population[index] for index in ranked[:self.elite]]
+        while len(next_population) < self.population_size:
+            parent_a = self.select(population, fitness, rng)
+            if rng.random() < self.crossover_rate:
+                child = crossover(parent_a, self.select(population, fitness, rng), rng)
+            else:
+                child = dict(parent_a)
+            next_population.append(mutate(child, self.bounds, rng, self.mutation_rate, self.mutation_scale))
+        return next_population
+
+    def select(self, population, fitness, rng):
+        contenders = rng.sample(range(len(population)), min(self.tournament_size, len(population)))
+        return population[max(contenders, key=lambda index: fitness[index])]
+
+    def record_best_game(self, generation, population, best, games):
+        # Replay the game where the best individual scored the most, this time recording it
+        best_games = [game for game in games if best in game['individuals']]
+        if not best_games:
+            return
+        game = max(best_games, key=lambda game: game['scores'].get(best, float('-inf')))
+        experiment_config = game_experiment_config(self.base_config, self.creature_type,
+                                                   [(index, population[index]) for index in game['individuals']])
+        run_game(experiment_config, game['seed'], 1, True,
+                 {'evolution': {'output_dir': self.output_dir, 'generation': generation, 'best_individual': best}})
+
+    def run(self, workers=None):
+        """Evolve the population, returns the last checkpoint."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        checkpoint = self.load_last_checkpoint()
+        if checkpoint is None:
+            generation = 0
+            rng = self.generation_rng(generation)
+            population = [random_individual(self.bounds, rng) for _ in range(self.population_size)]
+        else:
+            generation = checkpoint['generation'] + 1
+            rng = self.generation_rng(generation)
+            population = self.breed(checkpoint['population'], checkpoint['fitness'], rng)
+            print(f"Resuming after generation {checkpoint['generation']}")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while generation < self.generations:
+                fitness, games = self.evaluate(executor, generation, population, rng)
+                best = max(range(len(population)), key=lambda index: fitness[index])
+                print(f"Generation {generation}: best fitness {fitness[best]:.2f}, "
+                      f"mean fitness {sum(fitness) / len(fitness):.2f}")
+                if self.record == 'best':
+                    self.record_best_game(generation, population, best, games)
+
+                checkpoint = {
+                    'evolution_config': self.evolution_config,
+                    'generation': generation,
+                    'population': population,
+                    'fitness': fitness,
+                    'best': {'index': best, 'genes': population[best], 'fitness': fitness[best]},
+                    'games': games,
+                }
+                # Write the checkpoint atomically, a resumed run must never read half of one
+                partial_path = self.checkpoint_path(generation) + '.partial'
+                with open(partial_path, 'w') as f:
+                    json.dump(checkpoint, f, indent=4)
+                os.replace(partial_path, self.checkpoint_path(generation))
+
+                generation += 1
+                rng = self.generation_rng(generation)
+                population = self.breed(population, fitness, rng)
+        return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evolve AutoChess creature parameters in a tournament of small games.')
+    parser.add_argument('evolution_config', type=str, nargs='?', default='evolution_config.json', help='Path to the evolution configuration.')
+    parser.add_argument('-o', '--output-dir', type=str, help='Checkpoint directory, an existing one is resumed.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, defaults to the number of CPUs.')
+
+    args = parser.parse_args()
+
+    tournament = EvolutionaryTournament(load_experiment_config(args.evolution_config), args.output_dir)
+    checkpoint = tournament.run(args.workers)
+    if checkpoint is None:
+        print(f"Nothing to do, {tournament.output_dir} already has every generation")
+        return
+    print(f"Best individual of generation {checkpoint['generation']}: {checkpoint['best']['genes']}")
+    print(f"Checkpoints saved to {tournament.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -145,11 +145,10 @@ def main():
     time_limit = 500 # Set your desired time limit here
     while True:
         game.simulate_turn()
-        alive_creatures = [creature for creature in game.game_objects if isinstance(creature, SimulationCreature) and creature.health > 0]
-        if len(alive_creatures) == 1: 
-            game.winner = alive_creatures[0].name
+        if game.creature_count == 1: 
+            game.winner = game.creatures[0].name
             break
-        if Game.get_time() >= time_limit or len(alive_creatures) == 0:
+        if Game.get_time() >= time_limit or game.creature_count == 0:
             game.winner = "Draw"
             break
 
@@ -1,113 +1,211 @@
 import json
 import os
+import argparse
+from functools import partial
 import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime
-
-# Specify the directory containing the JSON files
-playbacks_dir = "playbacks"
-
-# Specify the output directory for saving the heatmap images
-output_dir = "statistics"
-
-# Specify the number of bins for the heatmaps
-num_bins = 50
-
-# Initialize variables to store the accumulated data
-accumulated_damage_grid = None
-accumulated_position_grid = None
-
-# Initialize variables to store the additional information
-total_games = 0
-total_creatures = 0
-total_turns = 0
-
-# Iterate through all JSON files in the playbacks directory
-for filename in os.listdir(playbacks_dir):
-    if filename.endswith(".json"):
-        file_path = os.path.join(playbacks_dir, filename)
-        
-        # Read the JSON file
-        with open(file_path) as file:
-            data = json.load(file)
-        
-        # Extract the arena dimensions
-        arena_width = data['header']['arena']['width']
-        arena_height = data['header']['arena']['height']
-        
-        # Create or update the accumulated grids
-        if accumulated_damage_grid is None:
-            accumulated_damage_grid = np.zeros((num_bins, num_bins))
-            accumulated_position_grid = np.zeros((num_bins, num_bins))
-        
-        # Calculate the bin size based on the arena dimensions
-        bin_width = arena_width / num_bins
-        bin_height = arena_height / num_bins
-        
-        # Iterate through the events and update the accumulated grids
-        for timestep, events in data['events'].items():
-            for event in events:
-                if event['type'] == 'deltaSetter':
-                    creature_id = event['id']
-                    creature = next((c for c in data['header']['creatures'] if c['id'] == creature_id), None)
-                    if creature:
-                        if event['attribute'] == 'health':
-                            position = creature['position']
-                            x_bin = int(position[0] / bin_width)
-                            y_bin = int(position[1] / bin_height)
-                            accumulated_damage_grid[y_bin, x_bin] += 1
-                        elif event['attribute'] == 'position':
-                            position = event['value']
-                            x_bin = int(position[0] / bin_width)
-                            y_bin = int(position[1] / bin_height)
-                            accumulated_position_grid[y_bin, x_bin] += 1
-        
-        # Update the additional information
-        total_games += 1
-        total_creatures += len(data['header']['creatures'])
-        total_turns += len(data['events'])  # Accumulate the total number of turns
-
-# Apply Gaussian blur to the accumulated grids (optional)
 from scipy.ndimage import gaussian_filter
-accumulated_damage_grid = gaussian_filter(accumulated_damage_grid, sigma=1)
-accumulated_position_grid = gaussian_filter(accumulated_position_grid, sigma=1)
-
-# Normalize the accumulated position grid
-accumulated_position_grid /= np.max(accumulated_position_grid)
-
-# Create the output directory if it doesn't exist
-os.makedirs(output_dir, exist_ok=True)
-
-# Generate a timestamp for the output file names
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-# Save the heatmap of accumulated damage occurrences
-damage_output_file = os.path.join(output_dir, f"damage_heatmap_{timestamp}.png")
-fig, ax = plt.subplots(figsize=(10, 10))
-im = ax.imshow(accumulated_damage_grid, cmap='hot', interpolation='nearest')
-ax.set_title('Heatmap of Accumulated Damage Occurrences')
-ax.set_xlabel('X')
-ax.set_ylabel('Y')
-cbar = ax.figure.colorbar(im, ax=ax, label='Accumulated Damage Occurrences')
-fig.tight_layout(rect=[0, 0.03, 1, 0.95])
-fig.text(0.5, 0.01, f"Total Games: {total_games}, Total Creatures: {total_creatures}, Total Turns: {total_turns}",
-         ha='center', fontsize=12, bbox=dict(facecolor='white', alpha=0.8))
-fig.savefig(damage_output_file)
-plt.close(fig)
-
-# Save the heatmap of car positions
-position_output_file = os.path.join(output_dir, f"car_positions_heatmap_{timestamp}.png")
-fig, ax = plt.subplots(figsize=(10, 10))
-im = ax.imshow(accumulated_position_grid, cmap='hot', interpolation='nearest')
-ax.set_title('Heatmap of Car Positions')
-ax.set_xlabel('X')
-ax.set_ylabel('Y')
-cbar = ax.figure.colorbar(im, ax=ax, label='Normalized Car Position Occurrences')
-fig.tight_layout(rect=[0, 0.03, 1, 0.95])
-fig.text(0.5, 0.01, f"Total Games: {total_games}, Total Creatures: {total_creatures}, Total Turns: {total_turns}",
-         ha='center', fontsize=12, bbox=dict(facecolor='white', alpha=0.8))
-fig.savefig(position_output_file)
-plt.close(fig)
-
-print(f"Damage heatmap saved as {damage_output_file}")
-print(f"Car positions heatmap saved as {position_output_file}")
\ No newline at end of file
+from AutoChessMapReduce import map_reduce
+from AutoChessPlaybackIO import find_playbacks, load_playback
+
+def creature_event_positions(data):
+    """Positions of the creatures of one playback, normalized to the arena, as (x, y) arrays.
+
+    Returns the position of every position event, and the position each
+    creature had when each of its health events happened (the last position
+    event before it in the log). Health events before the first move fall
+    back to the header position.
+    """
+    header_positions = {creature['id']: creature['position'] for creature in data['header']['creatures']}
+
+    # One pass over the log, everything after it is array work
+    position_ids, position_order, position_x, position_y = [], [], [], []
+    health_ids, health_order = [], []
+    order = 0
+    for events in data['events'].values():
+        for event in events:
+            order += 1
+            if event['type'] != 'deltaSetter' or event['id'] not in header_positions:
+                continue
+            if event['attribute'] == 'position':
+                position_ids.append(event['id'])
+                position_order.append(order)
+                position_x.append(event['value'][0])
+                position_y.append(event['value'][1])
+            elif event['attribute'] == 'health':
+                health_ids.append(event['id'])
+                health_order.append(order)
+
+    position_ids = np.array(position_ids, dtype=np.int64)
+    position_x = np.array(position_x, dtype=float)
+    position_y = np.array(position_y, dtype=float)
+    health_ids = np.array(health_ids, dtype=np.int64)
+
+    # Sorting by (creature, log order) gives every creature's trajectory as a contiguous run,
+    # the position at a health event is then the last entry of its run before the event
+    stride = order + 1
+    position_keys = position_ids * stride + np.array(position_order, dtype=np.int64)
+    trajectory = np.argsort(position_keys, kind='stable')
+    trajectory_keys = position_keys[trajectory]
+    trajectory_ids = position_ids[trajectory]
+    health_keys = health_ids * stride + np.array(health_order, dtype=np.int64)
+    last_position = np.searchsorted(trajectory_keys, health_keys, side='right') - 1
+    found = last_position >= 0
+    found[found] = trajectory_ids[last_position[found]] == health_ids[found]
+
+    damage_x = np.array([header_positions[creature_id][0] for creature_id in health_ids.tolist()], dtype=float)
+    damage_y = np.array([header_positions[creature_id][1] for creature_id in health_ids.tolist()], dtype=float)
+    damage_x[found] = position_x[trajectory][last_position[found]]
+    damage_y[found] = position_y[trajectory][last_position[found]]
+
+    # Normalize, so arenas of different sizes share one grid
+    arena_width = data['header']['arena']['width']
+    arena_height = data['header']['arena']['height']
+    return (position_x / arena_width, position_y / arena_height), (damage_x / arena_width, damage_y / arena_height)
+
+
+def bin_positions(x, y, num_bins):
+    # Rows are y and columns are x, like the images, positions on the far walls go in the last bins
+    grid, _, _ = np.histogram2d(y, x, bins=num_bins, range=[[0, 1], [0, 1]])
+    return grid
+
+
+def extract_heatmap_grids(file_path, num_bins=50):
+    """Damage and position grids of one playback, with its game, creature and turn counts."""
+    # Read the playback file, compressed or not
+    data = load_playback(file_path)
+
+    (position_x, position_y), (damage_x, damage_y) = creature_event_positions(data)
+
+    return {
+        'damage_grid': bin_positions(damage_x, damage_y, num_bins),
+        'position_grid': bin_positions(position_x, position_y, num_bins),
+        'games': 1,
+        'creatures': len(data['header']['creatures']),
+        'turns': len(data['events']),  # The number of turns of the game
+    }
+
+
+class HeatmapAccumulator:
+    """Sum of the per-playback grids and counts, merged in the parent process.
+
+    The raw sums can be saved as a .npy grid stack with a JSON sidecar of
+    the counts, and added back by a later run instead of reprocessing the
+    playbacks.
+    """
+    def __init__(self, num_bins=50):
+        self.damage_grid = np.zeros((num_bins, num_bins))
+        self.position_grid = np.zeros((num_bins, num_bins))
+        self.total_games = 0
+        self.total_creatures = 0
+        self.total_turns = 0
+
+    def add(self, file_path, grids):
+        self.damage_grid += grids['damage_grid']
+        self.position_grid += grids['position_grid']
+        self.total_games += grids['games']
+        self.total_creatures += grids['creatures']
+        self.total_turns += grids['turns']
+
+    def save(self, grids_path):
+        np.save(grids_path, np.stack([self.damage_grid, self.position_grid]))
+        with open(os.path.splitext(grids_path)[0] + '.json', 'w') as f:
+            json.dump({'games': self.total_games, 'creatures': self.total_creatures, 'turns': self.total_turns}, f, indent=4)
+
+    def add_saved(self, grids_path):
+        """Add grids written by save(), which must have the same number of bins."""
+        damage_grid, position_grid = np.load(grids_path)
+        counts_path = os.path.splitext(grids_path)[0] + '.json'
+        counts = {'games': 0, 'creatures': 0, 'turns': 0}
+        if os.path.exists(counts_path):
+            with open(counts_path) as f:
+                counts = json.load(f)
+        self.add(grids_path, {'damage_grid': damage_grid, 'position_grid': position_grid, **counts})
+
+
+def accumulate_heatmaps(inputs=("playbacks",), num_bins=50, workers=None):
+    """Accumulate the grids of every playback directory and saved .npy grid stack in inputs."""
+    accumulator = HeatmapAccumulator(num_bins)
+    file_paths = []
+    for path in inputs:
+        if path.endswith('.npy'):
+            accumulator.add_saved(path)
+        else:
+            file_paths.extend(find_playbacks(path))
+    map_reduce(file_paths, partial(extract_heatmap_grids, num_bins=num_bins), accumulator.add, workers)
+    return accumulator
+
+
+def save_heatmaps(accumulator, output_dir="statistics"):
+    accumulated_damage_grid = accumulator.damage_grid
+    accumulated_position_grid = accumulator.position_grid
+    total_games = accumulator.total_games
+    total_creatures = accumulator.total_creatures
+    total_turns = accumulator.total_turns
+
+    # Apply Gaussian blur to the accumulated grids (optional)
+    accumulated_damage_grid = gaussian_filter(accumulated_damage_grid, sigma=1)
+    accumulated_position_grid = gaussian_filter(accumulated_position_grid, sigma=1)
+
+    # Normalize the accumulated position grid
+    accumulated_position_grid /= np.max(accumulated_position_grid)
+
+    # Create the output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Generate a timestamp for the output file names
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    # Save the raw sums, so later runs can be combined with this one
+    grids_output_file = os.path.join(output_dir, f"heatmap_grids_{timestamp}.npy")
+    accumulator.save(grids_output_file)
+
+    # Save the heatmap of accumulated damage occurrences
+    damage_output_file = os.path.join(output_dir, f"damage_heatmap_{timestamp}.png")
+    fig, ax = plt.subplots(figsize=(10, 10))
+    im = ax.imshow(accumulated_damage_grid, cmap='hot', interpolation='nearest')
+    ax.set_title('Heatmap of Accumulated Damage Occurrences')
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    cbar = ax.figure.colorbar(im, ax=ax, label='Accumulated Damage Occurrences')
+    fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+    fig.text(0.5, 0.01, f"Total Games: {total_games}, Total Creatures: {total_creatures}, Total Turns: {total_turns}",
+             ha='center', fontsize=12, bbox=dict(facecolor='white', alpha=0.8))
+    fig.savefig(damage_output_file)
+    plt.close(fig)
+
+    # Save the heatmap of car positions
+    position_output_file = os.path.join(output_dir, f"car_positions_heatmap_{timestamp}.png")
+    fig, ax = plt.subplots(figsize=(10, 10))
+    im = ax.imshow(accumulated_position_grid, cmap='hot', interpolation='nearest')
+    ax.set_title('Heatmap of Car Positions')
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    cbar = ax.figure.colorbar(im, ax=ax, label='Normalized Car Position Occurrences')
+    fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+    fig.text(0.5, 0.01, f"Total Games: {total_games}, Total Creatures: {total_creatures}, Total Turns: {total_turns}",
+             ha='center', fontsize=12, bbox=dict(facecolor='white', alpha=0.8))
+    fig.savefig(position_output_file)
+    plt.close(fig)
+
+    print(f"Heatmap grids saved as {grids_output_file}")
+    print(f"Damage heatmap saved as {damage_output_file}")
+    print(f"Car positions heatmap saved as {position_output_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Accumulate damage and position heatmaps over AutoChess replays.')
+    parser.add_argument('inputs', type=str, nargs='*', default=['playbacks'],
+                        help='Directories of JSON playback files and .npy grids saved by earlier runs.')
+    parser.add_argument('-o', '--output-dir', type=str, default='statistics', help='Directory for the heatmap images.')
+    parser.add_argument('-b', '--bins', type=int, default=50, help='Number of bins per heatmap axis.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, defaults to the number of CPUs.')
+
+    args = parser.parse_args()
+
+    accumulator = accumulate_heatmaps(args.inputs, args.bins, args.workers)
+    save_heatmaps(accumulator, args.output_dir)
+
+if __name__ == "__main__":
+    main()
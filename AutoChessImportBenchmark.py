@@ -0,0 +1,86 @@
+# AutoChessImportBenchmark.py
+
+import argparse
+import subprocess
+import sys
+
+RENDERING_MODULES = ['pygame', 'moviepy', 'PIL', 'matplotlib', 'scipy']
+
+# Entry points and the modules their import must not load
+ENTRY_POINTS = {
+    'AutoChessEngine': RENDERING_MODULES + ['numpy'],
+    'AutoChessPlaybackIO': RENDERING_MODULES + ['numpy'],
+    'AutoChessCatalog': RENDERING_MODULES + ['numpy'],
+    'AutoChessStatisticsExtractor': RENDERING_MODULES + ['numpy'],
+    'AutoChessRunningStatistics': RENDERING_MODULES + ['numpy'],
+    'AutoChessPlaybackWriter': RENDERING_MODULES + ['numpy'],
+    'AutoChessBatchSimulation': RENDERING_MODULES + ['AutoChessGameSimulation', 'AutoChessStatisticsExtractor'],
+    'AutoChessSweep': RENDERING_MODULES,
+    'AutoChessEvolution': RENDERING_MODULES,
+    'AutoChessRatings': RENDERING_MODULES,
+    'AutoChessDistributed': RENDERING_MODULES,
+    'AutoChessServer': RENDERING_MODULES,
+    'AutoChessTrajectoryExport': RENDERING_MODULES,
+    'AutoChessPlayer': ['moviepy', 'PIL', 'matplotlib', 'scipy'],
+    'AutoChessPlaybackToVideo': ['moviepy', 'PIL', 'matplotlib', 'scipy'],
+}
+
+
+def measure_import(module):
+    """Import module in a fresh interpreter with -X importtime.
+
+    Returns the cumulative import time of module in milliseconds and the
+    set of top-level packages that were imported along with it.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    cumulative_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # The header line
+        name = name.strip()
+        imported.add(name.split('.')[0])
+        if name == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, imported
+
+
+def run_benchmark(modules, repeat=3, max_ms=None):
+    """Measure every module repeat times, returns the rows (module, best ms, forbidden modules loaded) and whether all passed."""
+    rows = []
+    passed = True
+    for module in modules:
+        # The best of several runs is the least disturbed by the rest of the machine
+        best_ms, imported = min(measure_import(module) for _ in range(repeat))
+        forbidden = sorted(imported.intersection(ENTRY_POINTS.get(module, [])))
+        if forbidden or (max_ms is not None and best_ms > max_ms):
+            passed = False
+        rows.append((module, best_ms, forbidden))
+    return rows, passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup import time of the AutoChess entry points with python -X importtime.')
+    parser.add_argument('modules', type=str, nargs='*', help='Modules to measure, defaults to every entry point.')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='Fresh interpreters per module, the fastest one is reported.')
+    parser.add_argument('-m', '--max-ms', type=float, help='Fail if an import takes longer than this many milliseconds.')
+
+    args = parser.parse_args()
+
+    modules = args.modules or list(ENTRY_POINTS)
+    rows, passed = run_benchmark(modules, args.repeat, args.max_ms)
+    for module, best_ms, forbidden in rows:
+        problems = [f"loads {', '.join(forbidden)}"] if forbidden else []
+        if args.max_ms is not None and best_ms > args.max_ms:
+            problems.append(f"over {args.max_ms:g} ms")
+        print(f"{module:<30} {best_ms:8.1f} ms  {'; '.join(problems) or 'ok'}")
+    if not passed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# AutoChessMapReduce.py
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+
+def _map_file(map_function, path):
+    # Runs in a worker, an exception only fails its own file
+    try:
+        return path, map_function(path), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def map_reduce(paths, map_function, reduce_function, workers=None, chunksize=8):
+    """Apply map_function to every file on a process pool, and merge each result in the parent.
+
+    map_function(path) runs in a worker and must be a picklable top-level
+    function (or a functools.partial of one). reduce_function(path, result)
+    runs in the parent, in the order of paths, so the merged result does not
+    depend on which worker finishes first. With workers=1, or a single
+    file, everything runs in this process. A file whose map raises is
+    reported and skipped. Returns the list of (path, error) of the files
+    that failed.
+    """
+    if workers == 1 or len(paths) <= 1:
+        return _reduce((_map_file(map_function, path) for path in paths), reduce_function)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return _reduce(executor.map(_map_file, repeat(map_function), paths, chunksize=chunksize), reduce_function)
+
+
+def _reduce(results, reduce_function):
+    errors = []
+    for path, result, error in results:
+        if error is not None:
+            print(f"Skipping {path}: {error}")
+            errors.append((path, error))
+        else:
+            reduce_function(path, result)
+    return errors
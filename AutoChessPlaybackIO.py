@@ -0,0 +1,99 @@
+# AutoChessPlaybackIO.py
+
+import argparse
+import gzip
+import json
+import lzma
+import os
+
+# Playbacks are JSON, optionally compressed, the extension tells which
+COMPRESSION_EXTENSIONS = {None: '.json', 'gz': '.json.gz', 'xz': '.json.xz'}
+PLAYBACK_EXTENSIONS = tuple(COMPRESSION_EXTENSIONS.values())
+
+
+def is_playback_path(path):
+    return path.endswith(PLAYBACK_EXTENSIONS)
+
+
+def playback_compression(path):
+    """The compression of a playback file from its extension, None for plain JSON."""
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if compression and path.endswith(extension):
+            return compression
+    return None
+
+
+def playback_base_name(path):
+    """The file name of a playback without its directory and its .json, .json.gz or .json.xz extension."""
+    name = os.path.basename(path)
+    for extension in PLAYBACK_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return os.path.splitext(name)[0]
+
+
+def open_playback(path, mode='r', compression='auto'):
+    """Open a playback as a text file, compressed or not. compression defaults to the one of the extension."""
+    if compression == 'auto':
+        compression = playback_compression(path)
+    mode = mode if 't' in mode else mode + 't'
+    if compression == 'gz':
+        return gzip.open(path, mode)
+    if compression == 'xz':
+        return lzma.open(path, mode)
+    if compression is None:
+        return open(path, mode)
+    raise ValueError(f"Unknown playback compression: {compression}")
+
+
+def load_playback(path):
+    with open_playback(path) as f:
+        return json.load(f)
+
+
+def save_playback(path, game_record, fsync=False):
+    """Write a game record, compressed according to the extension of path."""
+    # Write under a temporary name, so an interrupted write never leaves a truncated playback
+    partial_path = path + '.partial'
+    with open_playback(partial_path, 'w', playback_compression(path)) as f:
+        json.dump(game_record, f, indent=4)
+    if fsync:
+        fd = os.open(partial_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    os.replace(partial_path, path)
+
+
+def find_playbacks(directory):
+    """Paths of the playback files of a directory, compressed or not, without batch outputs."""
+    return sorted(os.path.join(directory, filename) for filename in os.listdir(directory)
+                  if is_playback_path(filename) and 'batch_output' not in filename)
+
+
+def compress_playback(path, compression='gz'):
+    """Rewrite a playback with another compression (None for plain JSON), returns the new path."""
+    new_path = os.path.join(os.path.dirname(path), playback_base_name(path) + COMPRESSION_EXTENSIONS[compression])
+    if new_path != path:
+        save_playback(new_path, load_playback(path))
+        os.remove(path)
+    return new_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compress or decompress the AutoChess playbacks of a directory.')
+    parser.add_argument('playback_dir', type=str, nargs='?', default='playbacks', help='Directory containing the playback files.')
+    parser.add_argument('-c', '--compression', type=str, default='gz', choices=['gz', 'xz', 'none'],
+                        help='Compression to rewrite the playbacks with, none for plain JSON.')
+
+    args = parser.parse_args()
+
+    compression = None if args.compression == 'none' else args.compression
+    for path in find_playbacks(args.playback_dir):
+        new_path = compress_playback(path, compression)
+        if new_path != path:
+            print(f"{path} -> {new_path}")
+
+if __name__ == "__main__":
+    main()
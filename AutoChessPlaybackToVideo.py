@@ -2,16 +2,17 @@
 
 import json
 import argparse
-from AutoChessPlayer import AutoChessPlayer
-from moviepy.editor import ImageSequenceClip
-import numpy as np
 import os
+# Frames are drawn off-screen, so the video path never needs a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+from AutoChessPlayer import AutoChessPlayer
+from AutoChessPlaybackIO import playback_base_name
 import pygame
 
 
 class AutoChessPlaybackToVideo(AutoChessPlayer):
     def __init__(self, battle_log_path, config_path=None, screen_size=(800, 800), offset=(80, 80), canvas_dimensions=(670, 670), frame_rate=20):
-        super().__init__(battle_log_path, screen_size, offset, canvas_dimensions, output_image=True, render=True)
+        super().__init__(battle_log_path, screen_size, offset, canvas_dimensions, output_image=True, render=False)
         if config_path:
             with open(config_path, 'r') as f:
                 self.config = json.load(f)
@@ -20,20 +21,26 @@ class AutoChessPlaybackToVideo(AutoChessPlayer):
         self.frame_directory = self.config.get('frame_directory', 'frames')
         self.frame_rate = frame_rate
         self.video_file = self.config.get('video_file', 'output.mp4')
-        self.frames = [] # List to store frames in memory
+        self.writer = None  # ffmpeg pipe, open only while run() is encoding
 
+    def capture_frame(self):
+        # pixels3d is a view of the screen indexed (x, y), transposing the view gives
+        # the (row, column) layout ffmpeg expects without copying the surface first
+        frame = pygame.surfarray.pixels3d(self.screen).transpose(1, 0, 2)
+        self.writer.write_frame(frame)
+        del frame  # Release the view so the screen surface is unlocked for the next draw
 
     # AutoChessPlaybackToVideo.py
-    def run(self):
-        # Run the game as usual, which will now save frames due to the output_image flag
-        super().run()
-
-        # After the game has run, create a video from the captured frames
-        # Convert PIL images to NumPy arrays
-        self.frames = [np.array(frame) for frame in self.frames]
-
-        clip = ImageSequenceClip(self.frames, fps=self.frame_rate)
-        clip.write_videofile(self.video_file)
+    def run(self, first_tick=0, last_tick=None):
+        # Every frame is encoded as soon as it is drawn, nothing is kept in memory
+        from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+        self.writer = FFMPEG_VideoWriter(self.video_file, self.screen.get_size(), self.frame_rate)
+        try:
+            self.run_sequential(first_tick, last_tick)
+        finally:
+            self.writer.close()
+            self.writer = None
+        print(f"Video saved to {self.video_file}")
 
 def main():
     parser = argparse.ArgumentParser(description='Generate a video from an AutoChess replay.')
@@ -46,9 +53,9 @@ def main():
 
     player = AutoChessPlaybackToVideo(args.battle_log_path, args.config, frame_rate=args.fps)
 
-    # If no output file name is provided, use the base name of the .json file with .mp4 extension
+    # If no output file name is provided, use the base name of the playback file with .mp4 extension
     if not args.output:
-        base_name = os.path.splitext(os.path.basename(args.battle_log_path))[0]
+        base_name = playback_base_name(args.battle_log_path)
         player.video_file = os.path.join('playbacks', f"v_{base_name}.mp4")
     else:
         # If an output file name is provided, ensure it's saved in the playbacks folder
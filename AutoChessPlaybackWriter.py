@@ -0,0 +1,92 @@
+# AutoChessPlaybackWriter.py
+
+import multiprocessing
+import queue
+import signal
+import threading
+from AutoChessEngine import write_game_record
+from AutoChessCatalog import PlaybackCatalog
+
+
+def _write_playbacks(pending, catalog_path, fsync):
+    # Runs in the writer thread or process until it takes the None sentinel off the queue
+    if threading.current_thread() is threading.main_thread():
+        # Only a writer process gets here. Ctrl-C goes to the whole process group, the parent decides when it stops
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # SQLite connections belong to the thread that opened them, so the writer has its own
+    catalog = PlaybackCatalog(catalog_path) if catalog_path else None
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            filename, game_record = item
+            try:
+                write_game_record(filename, game_record, catalog, fsync)
+                print(f"Simulation saved to {filename}")
+            except Exception as e:
+                print(f"Failed to save {filename}: {type(e).__name__}: {e}")
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+
+class PlaybackWriter:
+    """Writes game records in the background while the next game is simulated.
+
+    mode is "thread", "process" or "inline" (write before returning, like
+    record_game). At most queue_size records wait to be written, beyond that
+    write() blocks until the disk catches up. close() writes everything still
+    queued, also when called on the way out of an interrupt.
+    """
+    def __init__(self, mode='thread', queue_size=2, catalog_path=None, fsync=False):
+        self.mode = mode
+        self.catalog_path = catalog_path
+        self.fsync = fsync
+        self.catalog = None
+        self.worker = None
+        if mode == 'inline':
+            self.catalog = PlaybackCatalog(catalog_path) if catalog_path else None
+        elif mode == 'thread':
+            self.pending = queue.Queue(maxsize=queue_size)
+            self.worker = threading.Thread(target=_write_playbacks, args=(self.pending, catalog_path, fsync),
+                                           name='playback-writer')
+        elif mode == 'process':
+            self.pending = multiprocessing.Queue(maxsize=queue_size)
+            self.worker = multiprocessing.Process(target=_write_playbacks, args=(self.pending, catalog_path, fsync),
+                                                  name='playback-writer')
+        else:
+            raise ValueError(f"Unknown playback writer mode: {mode}")
+        if self.worker is not None:
+            self.worker.start()
+
+    def write(self, filename, game_record):
+        if self.worker is None:
+            write_game_record(filename, game_record, self.catalog, self.fsync)
+            print(f"Simulation saved to {filename}")
+        else:
+            # Blocks while the queue is full, but not forever if the writer is gone
+            while True:
+                try:
+                    self.pending.put((filename, game_record), timeout=1)
+                    break
+                except queue.Full:
+                    if not self.worker.is_alive():
+                        raise RuntimeError("The playback writer stopped")
+
+    def close(self):
+        """Wait for every queued record to be written, then stop the writer."""
+        if self.worker is not None:
+            if self.worker.is_alive():
+                self.pending.put(None)
+            self.worker.join()
+            self.worker = None
+        if self.catalog is not None:
+            self.catalog.close()
+            self.catalog = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -2,12 +2,9 @@
 import json
 import sys
 from AutoChessEngine import *
-from moviepy.editor import ImageSequenceClip
-from PIL import Image
-import glob
+from AutoChessPlaybackIO import find_playbacks, load_playback
 import os
 import pygame
-import moviepy
 import argparse
 
 class SpriteManager:
@@ -23,13 +20,49 @@ class SpriteManager:
                 self.loaded_sprites[sprite_filename] = None
         return self.loaded_sprites[sprite_filename]
 
+class PlaybackEventIndex:
+    """Single-pass index of a battle log's events, shared by the game and every playback object.
+
+    object_events maps an object id to its deltaSetter events keyed by integer
+    tick, and lifecycle maps a tick to its creation and destruction events in
+    log order.
+    """
+    def __init__(self, events):
+        self.object_events = {}
+        self.lifecycle = {}
+        self.ticks = set()
+
+        for time_key, tick_events in events.items():
+            tick = int(time_key)
+            self.ticks.add(tick)
+            for event in tick_events:
+                if event['type'] == 'deltaSetter':
+                    self.object_events.setdefault(event['id'], {}).setdefault(tick, []).append(event)
+                else:
+                    self.lifecycle.setdefault(tick, []).append(event)
+
+        self.num_ticks = len(self.ticks)
+
+    def has_tick(self, tick):
+        return tick in self.ticks
+
+    def events_for(self, object_id):
+        """Per-tick events of one object. The dict is owned by the index, not copied."""
+        return self.object_events.setdefault(object_id, {})
+
+    def lifecycle_events(self, tick):
+        return self.lifecycle.get(tick, [])
+
+
 class PlaybackGame(Game):
-    def __init__(self, arena,battle_log=None):
+    def __init__(self, arena,battle_log=None, event_index=None):
         super().__init__(arena)
         self.set_game_for_creatures()
         self.show_bounding_boxes = True  # Start with bounding boxes
         self.draw_shooting_ranges = True  # Start with shooting ranges
         self.battle_log = battle_log
+        self.event_index = event_index
+        self.render_cache = RenderCache()  # Fonts, text and rotated sprites shared by every frame
         
 
     def toggle_bounding_boxes(self):
@@ -37,10 +70,34 @@ class PlaybackGame(Game):
 
     def toggle_shooting_ranges(self):
             self.draw_shooting_ranges = not self.draw_shooting_ranges
+
+    def record_event(self, event):
+        # Replayed setters must not log their events again
+        pass
+
+    def apply_tick(self, tick):
+        """Replay the events of one tick, leaving the game clock on the following tick."""
+        Game.set_time(tick)
+        self.update_from_events()
+        Game.set_time(tick + 1)
+
+    def capture_keyframe(self):
+        return [(game_object, game_object.get_playback_state()) for game_object in self.game_objects]
+
+    def restore_keyframe(self, keyframe):
+        self.game_objects = [game_object for game_object, _ in keyframe]
+        for game_object, state in keyframe:
+            game_object.set_playback_state(state)
+        self.cemetery.clear()
     
     # Now handling only all creatures, should handle all kinds of events later
     def update_from_events(self):
-        current_events = self.global_events.get(str(Game.get_time()), [])
+        current_events = self.event_index.lifecycle_events(Game.get_time())
+
+        # The shoot timer only drives the cooldown arc, it counts up until the next shot resets it
+        for game_object in self.game_objects:
+            if isinstance(game_object, PlaybackCreature) and game_object.shoot_timer < game_object.shoot_cooldown:
+                game_object.shoot_timer += 1
 
         for event in current_events:
             if event['type'] == 'creation':
@@ -57,12 +114,8 @@ class PlaybackGame(Game):
                     size = details.get('size')
                     origin_id = event.get('origin_id')
 
-                    # Extract all events for this playback_id, indexed by time
-                    event_dict = {time: [event for event in self.battle_log['events'][time] if event['id'] == playback_id] 
-                            for time in self.battle_log['events']}
-
-                    # Filter out times with no events for this playback_id
-                    event_dict = {time: events for time, events in event_dict.items() if events}
+                    # The object reads its events straight from the shared index
+                    event_dict = self.event_index.events_for(playback_id)
 
                     # Create a new object and add it to game_objects
                     collider = RectCollider(position, size, angle)
@@ -83,24 +136,11 @@ class PlaybackGame(Game):
         for game_object in self.game_objects:
             game_object.move()
 
-        
-
-    def reset_objects(self):
-
-        # Reset each creature to its initial state at the start of the playback loop
-        for creature in self.cemetery:
-            if isinstance(creature, PlaybackCreature): # Check if the object is a PlaybackCreature
-                creature.reset_to_initial_state()
-                self.game_objects.append(creature)
-        self.game_objects = [obj for obj in self.game_objects if isinstance(obj, PlaybackCreature) or isinstance(obj, PlaybackObstacle)]
-        # The game_objects now only contains PlaybackCreatures
-        self.cemetery.clear()
-        
 
 class AutoChessPlayer:
-    def __init__(self, battle_log_path, screen_size=(800, 800), offset=(80, 80), canvas_dimensions=(670, 670), output_image=False, render=True):
-        with open(battle_log_path, 'r') as f:
-            self.battle_log = json.load(f)
+    def __init__(self, battle_log_path, screen_size=(800, 800), offset=(80, 80), canvas_dimensions=(670, 670), output_image=False, render=True,
+                 keyframe_interval=25, tick_rate=10, render_fps=60):
+        self.battle_log = load_playback(battle_log_path)
 
         if 'header' not in self.battle_log:
             print(f"Error: Missing 'header' key in the battle log file: {battle_log_path}")
@@ -133,12 +173,26 @@ class AutoChessPlayer:
         pygame.init()
         self.screen = pygame.display.set_mode(self.screen_size)
 
-        self.game = PlaybackGame(Arena(*canvas_dimensions), self.battle_log)
+        # Built once, every playback object reads its events from here
+        self.event_index = PlaybackEventIndex(self.battle_log['events'])
+
+        self.game = PlaybackGame(Arena(*canvas_dimensions), self.battle_log, self.event_index)
         self.initialize_creatures_for_playback()
-        self.initialize_global_events()
+
+        # Keyframes of the whole replayed state, so any tick is at most keyframe_interval ticks away
+        self.keyframe_interval = keyframe_interval
+        self.last_tick = self.event_index.num_ticks - 1
+        self.current_tick = -1  # Last applied tick, -1 is the state from the header
+        self.previous_poses = {}  # id -> (center, angle) before the last applied tick, for interpolation
+        self.keyframes = {}
+        self.build_keyframes()
 
         # Setup playback control
         self.playing = True
+        self.running = True
+        self.tick_rate = tick_rate  # Ticks per second at 1x speed
+        self.render_fps = render_fps
+        self.playback_speed = 1.0
 
         # self.background = pygame.image.load('assets/bg5.png')
         self.background = pygame.Surface(self.screen.get_size())
@@ -149,6 +203,12 @@ class AutoChessPlayer:
         # Define arena_rect here
         self.arena_rect = pygame.Rect(self.offset[0], self.offset[1], self.canvas_dimensions[0], self.canvas_dimensions[1])
 
+        # Background, arena and obstacles never move, they are prerendered once per scale
+        self.static_layer = None
+        self.static_layer_key = None
+        self.drawn_rects = None  # Areas drawn over the static layer by the last frame, None when unknown
+        self.dirty_rects = []  # Areas changed by the last frame, for pygame.display.update
+
         # UI Controls
         self.button_color = (0, 200, 0)
         self.button_hover_color = (0, 255, 0)
@@ -173,8 +233,7 @@ class AutoChessPlayer:
             scaled_size = self.scale_size(size)
 
             collider = RectCollider(center=position, size=scaled_size, angle=info['angle'])
-            creature_events = {str(time): [event for event in events if event['id'] == info['id']]
-                            for time, events in self.battle_log['events'].items()}
+            creature_events = self.event_index.events_for(info['id'])
 
             creature_name = info['name']
             creature_type = creature_name.split()[0]  # Extract the creature type from the name
@@ -218,10 +277,6 @@ class AutoChessPlayer:
         self.game.game_objects = creatures + obstacles
         self.game.winner = self.battle_log['header']['winner']
 
-    def initialize_global_events(self):
-        for time, events in self.battle_log['events'].items():
-            self.game.global_events[time] = [event for event in events if event['type'] in ['creation', 'destruction']]
-
 
     def scale_size(self, size):
         """Scales the size from arena to screen dimensions based on the calculated scale ratio."""
@@ -249,7 +304,44 @@ class AutoChessPlayer:
     def play_pause(self):
         self.playing = not self.playing
 
-
+    def build_keyframes(self):
+        """Replay the whole log once, keeping a keyframe every keyframe_interval ticks."""
+        self.keyframes[-1] = self.game.capture_keyframe()
+        for tick in range(self.last_tick + 1):
+            self.game.apply_tick(tick)
+            self.current_tick = tick
+            if tick % self.keyframe_interval == 0:
+                self.keyframes[tick] = self.game.capture_keyframe()
+        self.seek(-1)
+
+    def seek(self, tick):
+        """Jump to the state after the given tick, replaying at most keyframe_interval ticks."""
+        tick = max(-1, min(tick, self.last_tick))
+        if not (self.current_tick <= tick < self.current_tick + self.keyframe_interval):
+            keyframe_tick = max(-1, (tick // self.keyframe_interval) * self.keyframe_interval)
+            self.game.restore_keyframe(self.keyframes[keyframe_tick])
+            self.current_tick = keyframe_tick
+            Game.set_time(keyframe_tick + 1)
+        while self.current_tick < tick:
+            self.current_tick += 1
+            self.game.apply_tick(self.current_tick)
+        # Nothing to interpolate from after a jump
+        self.previous_poses = {}
+
+    def step(self, ticks=1):
+        """Advance by whole ticks, remembering the poses before the last one for interpolation."""
+        target = min(self.current_tick + ticks, self.last_tick)
+        if target - self.current_tick > 1:
+            # Frame skipping, only the last tick of the batch is ever drawn
+            self.seek(target - 1)
+        if self.current_tick < target:
+            self.previous_poses = {game_object.id: (game_object.collider.center, game_object.collider.angle)
+                                   for game_object in self.game.game_objects}
+            self.current_tick += 1
+            self.game.apply_tick(self.current_tick)
+
+    def change_speed(self, factor):
+        self.playback_speed = max(0.125, min(self.playback_speed * factor, 64.0))
 
     def handle_events(self):
         for event in pygame.event.get():
@@ -260,12 +352,32 @@ class AutoChessPlayer:
                 if self.button_rect.collidepoint(pygame.mouse.get_pos()):
                     self.play_pause()
             elif event.type == pygame.KEYDOWN:  # Check for key presses
+                # Shift makes the scrubbing keys finer
+                scrub = 1 if event.mod & pygame.KMOD_SHIFT else 10
                 if event.key == pygame.K_SPACE:  # If the spacebar is pressed
                     self.play_pause()  # Toggle the play/pause state
                 elif event.key == pygame.K_z:  # If the 'z' key is pressed
                     self.game.toggle_bounding_boxes()  # Toggle the bounding boxes
                 elif event.key == pygame.K_r: # If the 'r' key is pressed
                     self.game.toggle_shooting_ranges()
+                elif event.key == pygame.K_RIGHT:
+                    self.seek(self.current_tick + scrub)
+                elif event.key == pygame.K_LEFT:
+                    self.seek(self.current_tick - scrub)
+                elif event.key == pygame.K_PAGEUP:
+                    self.seek(self.current_tick + 10 * scrub)
+                elif event.key == pygame.K_PAGEDOWN:
+                    self.seek(self.current_tick - 10 * scrub)
+                elif event.key == pygame.K_HOME:
+                    self.seek(0)
+                elif event.key == pygame.K_END:
+                    self.seek(self.last_tick)
+                elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                    self.change_speed(2)
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    self.change_speed(0.5)
+                elif event.key == pygame.K_ESCAPE:
+                    self.running = False
                     
 
 
@@ -278,38 +390,102 @@ class AutoChessPlayer:
         # self.screen.blit(text_surface, text_rect)
 
         # Display current event_index at the top-right of the screen
-        total_turns = len(self.battle_log['events'])
+        total_turns = self.event_index.num_ticks
         current_turn = Game.get_time()
         event_index_text = f'Turn: {current_turn}/{total_turns}'
+        if self.playback_speed != 1:
+            event_index_text += f' x{self.playback_speed:g}'
         event_index_surface = self.font.render(event_index_text, True, (255, 255, 255))
         event_index_rect = event_index_surface.get_rect(topright=(self.screen.get_width() - 10, 10))
-        self.screen.blit(event_index_surface, event_index_rect)
+        return self.screen.blit(event_index_surface, event_index_rect)
 
 
-    def generate_frame(self):
-        # Clear the screen
-        self.screen.fill((0, 0, 0))
+    def build_static_layer(self):
+        """Prerender the background, the arena border and the obstacles into one surface."""
+        self.static_layer = pygame.Surface(self.screen.get_size())
+        self.static_layer.fill((0, 0, 0))
 
         # Draw the background
-        self.screen.blit(self.background, (0, 0))
+        self.static_layer.blit(self.background, (0, 0))
 
         # Draw the arena
-        pygame.draw.rect(self.screen, (255, 100, 100), self.arena_rect, 2)
+        pygame.draw.rect(self.static_layer, (255, 100, 100), self.arena_rect, 2)
+
+        # Draw the obstacles
+        for game_object in self.game.game_objects:
+            if isinstance(game_object, PlaybackObstacle):
+                game_object.draw(self.static_layer, self.virtual_to_screen)
+
+        self.static_layer_key = (self.screen.get_size(), self.scale_ratio, self.offset)
+        self.drawn_rects = None  # The whole screen has to be redrawn
+
+    def generate_frame(self, alpha=1.0):
+        if self.static_layer_key != (self.screen.get_size(), self.scale_ratio, self.offset):
+            self.build_static_layer()
+
+        # Erase the last frame by copying the static layer back over what it drew
+        if self.drawn_rects is None:
+            erased_rects = [self.screen.blit(self.static_layer, (0, 0))]
+        else:
+            erased_rects = [self.screen.blit(self.static_layer, rect, rect) for rect in self.drawn_rects]
 
-        # Draw the game objects
+        # Draw the game objects, obstacles are already in the static layer
+        screen_rect = self.screen.get_rect()
+        drawn_rects = []
         for game_object in self.game.game_objects:
-            game_object.draw(self.screen, self.virtual_to_screen)
+            if isinstance(game_object, PlaybackObstacle):
+                continue
+            previous_pose = self.previous_poses.get(game_object.id) if alpha < 1 else None
+            if previous_pose is None:
+                drawn_rect = game_object.draw(self.screen, self.virtual_to_screen)
+            else:
+                drawn_rect = self.draw_interpolated(game_object, previous_pose, alpha)
+            # An object that does not report what it drew dirties the whole screen
+            drawn_rects.append(screen_rect if drawn_rect is None else drawn_rect.clip(screen_rect))
 
         # Draw the GUI
-        self.draw_GUI()
+        drawn_rects.append(self.draw_GUI())
+
+        self.drawn_rects = drawn_rects
+        self.dirty_rects = erased_rects + drawn_rects
 
-        # If output_image is True, return the current screen as a PIL image
+        # If output_image is True, hand the current screen to capture_frame
         if self.output_image:
-            frame_copy = self.screen.copy()
-            # Resize the frame to the desired dimensions
-            frame_copy = pygame.transform.scale(frame_copy, self.screen.get_size())
-            pil_image = Image.frombytes("RGBA", frame_copy.get_size(), pygame.image.tostring(frame_copy, "RGBA"))
-            self.frames.append(pil_image)
+            self.capture_frame()
+
+    def capture_frame(self):
+        # Store the current screen as a PIL image, subclasses can send it somewhere else
+        from PIL import Image
+        pil_image = Image.frombytes("RGBA", self.screen.get_size(), pygame.image.tostring(self.screen, "RGBA"))
+        self.frames.append(pil_image)
+
+    def draw_interpolated(self, game_object, previous_pose, alpha):
+        # Draw the object between its previous and current pose, then put the current pose back
+        center, angle = game_object.collider.center, game_object.collider.angle
+        previous_center, previous_angle = previous_pose
+        angle_diff = (angle - previous_angle + 180) % 360 - 180  # Shortest way around
+        game_object.collider.center = (previous_center[0] + (center[0] - previous_center[0]) * alpha,
+                                       previous_center[1] + (center[1] - previous_center[1]) * alpha)
+        game_object.collider.angle = (previous_angle + angle_diff * alpha) % 360
+        drawn_rect = game_object.draw(self.screen, self.virtual_to_screen)
+        # Centers loaded from a playback are lists, which the setter rejects
+        game_object.collider._center, game_object.collider._angle = center, angle
+        return drawn_rect
+
+    def draw_winner(self):
+        if self.game.winner == "Draw":
+            winner_text = "It's a draw!"
+            # Add an extra frame with the winner's name
+        else:
+            winner_text = f"{self.game.winner} wins!"
+
+        # Render the winner's name text
+        text_surface = self.font.render(winner_text, True, (255, 255, 255))
+        text_rect = text_surface.get_rect(center=self.screen.get_rect().center)
+        winner_rect = self.screen.blit(text_surface, text_rect)
+        # Part of the frame, so the next frame erases it
+        self.drawn_rects.append(winner_rect)
+        self.dirty_rects.append(winner_rect)
 
     def capture_last_frame(self):
         # Capture the last frame of the game
@@ -317,70 +493,67 @@ class AutoChessPlayer:
         return last_frame
 
     def run(self):
-        clock = pygame.time.Clock()
-        # Manually call update_from_events to simulate the first update without rendering
-        if str(Game.get_time()) in self.battle_log['events']:
-            self.game.update_from_events()
-            Game.update_time()
+        if self.output_image:
+            self.run_sequential()
         else:
-            # Reset time and creatures' states to loop the playback
-            Game.reset_time()
-            self.game.reset_objects()
-
-        while True:
-            self.handle_events()
+            self.run_interactive()
 
-            if self.playing:
-                if str(Game.get_time()) in self.battle_log['events']:
-                    self.game.update_from_events()
-                    Game.update_time()
-                else:
-                    # Reset time and creatures' states to loop the playback
-                    Game.reset_time()
-                    self.game.reset_objects()
+    def run_interactive(self):
+        """Play at playback_speed, rendering at render_fps with positions interpolated between ticks."""
+        clock = pygame.time.Clock()
+        tick_progress = 0.0  # Fraction of a tick elapsed since the last applied one
 
-            # Start rendering at time 0
-            if Game.get_time() >= 0:
-                self.generate_frame()
+        while self.running:
+            elapsed = clock.tick(self.render_fps) / 1000
+            self.handle_events()
 
-                if self.render:
-                    pygame.display.flip()
+            if self.playing and self.current_tick < self.last_tick:
+                tick_progress += elapsed * self.tick_rate * self.playback_speed
+                whole_ticks = int(tick_progress)
+                if whole_ticks:
+                    tick_progress -= whole_ticks
+                    self.step(whole_ticks)
+            else:
+                tick_progress = 0.0
 
-                if not self.playing or Game.get_time() >= len(self.battle_log['events']):
-                    break
+            self.generate_frame(min(tick_progress, 1.0) if self.playing else 1.0)
+            if self.current_tick >= self.last_tick:
+                self.draw_winner()
+            if self.render:
+                # Only the areas drawn or erased by this frame reach the display
+                pygame.display.update(self.dirty_rects)
 
-            clock.tick(10) # Control playback speed
-        
+    def run_sequential(self, first_tick=0, last_tick=None):
+        """Render ticks first_tick..last_tick once, in order, then a frame with the winner if the game ended."""
+        clock = pygame.time.Clock()
+        last_tick = self.last_tick if last_tick is None else min(last_tick, self.last_tick)
+        self.seek(first_tick - 1)
 
-        # last_frame = self.capture_last_frame()
+        while self.current_tick < last_tick:
+            self.handle_events()
+            self.step()
+            self.generate_frame()
 
-        if self.game.winner == "Draw":
-            winner_text = "It's a draw!"
-            # Add an extra frame with the winner's name
-        else:
-            winner_text = f"{self.game.winner} wins!"
+            if self.render:
+                pygame.display.flip()
+                clock.tick(self.tick_rate) # Control playback speed, only when someone is watching
 
-        # Render the winner's name text
-        text_surface = self.font.render(winner_text, True, (255, 255, 255))
-        text_rect = text_surface.get_rect(center=self.screen.get_rect().center)
-        self.screen.blit(text_surface, text_rect)
-        pygame.display.flip() # Update the display
+        if last_tick < self.last_tick:
+            return  # A middle segment of the game, the winner comes later
 
+        self.draw_winner()
         # Capture the last frame with the winner's name
-        last_frame = self.screen.copy()
-        # Resize the last frame to match the dimensions of the other frames
-        last_frame = pygame.transform.scale(last_frame, self.screen.get_size())
-        # Convert the last frame to a PIL Image object in RGBA mode
-        last_frame_pil = Image.frombytes("RGBA", last_frame.get_size(), pygame.image.tostring(last_frame, "RGBA"))
-        self.frames.append(last_frame_pil)
+        self.capture_frame()
 
-        # Wait for 3 seconds before ending the video
-        pygame.time.wait(3000)
+        if self.render:
+            pygame.display.flip() # Update the display
+            # Keep the winner on screen for 3 seconds
+            pygame.time.wait(3000)
 
 
 if __name__ == "__main__":
-    # Get a list of all JSON files in the directory
-    json_files = glob.glob('playbacks/*.json')
+    # Get a list of all playback files in the directory, compressed or not
+    json_files = find_playbacks('playbacks')
 
     # Find the most recent file
     latest_file = max(json_files, key=os.path.getctime)
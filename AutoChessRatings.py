@@ -0,0 +1,208 @@
+# AutoChessRatings.py
+
+import argparse
+import copy
+import itertools
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor
+from AutoChessBatchSimulation import load_experiment_config
+from AutoChessCatalog import PlaybackCatalog, DEFAULT_CATALOG_PATH
+from AutoChessEvolution import fixed_creature_config, run_game
+
+# TrueSkill defaults, on the usual 0-50 scale
+INITIAL_MU = 25.0
+INITIAL_SIGMA = INITIAL_MU / 3
+BETA = INITIAL_SIGMA / 2  # Performance spread of a single game
+TAU = INITIAL_SIGMA / 100  # Skill drift added before every game, keeps sigma from collapsing
+
+RATINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    build TEXT PRIMARY KEY,
+    mu REAL,
+    sigma REAL,
+    games INTEGER,
+    wins INTEGER
+);
+CREATE TABLE IF NOT EXISTS rated_games (
+    filename TEXT PRIMARY KEY,
+    winner_build TEXT,
+    loser_build TEXT
+);
+"""
+
+
+def _pdf(x):
+    return math.exp(-x * x / 2) / math.sqrt(2 * math.pi)
+
+
+def _cdf(x):
+    return (1 + math.erf(x / math.sqrt(2))) / 2
+
+
+class Rating:
+    """Gaussian belief about the skill of a build, TrueSkill style."""
+    def __init__(self, mu=INITIAL_MU, sigma=INITIAL_SIGMA, games=0, wins=0):
+        self.mu = mu
+        self.sigma = sigma
+        self.games = games
+        self.wins = wins
+
+    def conservative(self):
+        # The skill the build has with 99% confidence, what the ranking sorts by
+        return self.mu - 3 * self.sigma
+
+
+def rate_match(winner, loser, beta=BETA, tau=TAU):
+    """Update two ratings in place after winner beat loser (two-player TrueSkill without draws)."""
+    winner_variance = winner.sigma ** 2 + tau ** 2
+    loser_variance = loser.sigma ** 2 + tau ** 2
+    c = math.sqrt(2 * beta ** 2 + winner_variance + loser_variance)
+    t = (winner.mu - loser.mu) / c
+    # A tail probability below float precision would divide by zero, the win was certain anyway
+    v = _pdf(t) / max(_cdf(t), 1e-300)
+    w = v * (v + t)
+    winner.mu += winner_variance / c * v
+    loser.mu -= loser_variance / c * v
+    winner.sigma = math.sqrt(winner_variance * max(1 - winner_variance / c ** 2 * w, 1e-6))
+    loser.sigma = math.sqrt(loser_variance * max(1 - loser_variance / c ** 2 * w, 1e-6))
+    winner.games += 1
+    loser.games += 1
+    winner.wins += 1
+
+
+def match_quality(a, b, beta=BETA):
+    """How close to even a match is expected to be, 1 for identical certain ratings."""
+    c2 = 2 * beta ** 2 + a.sigma ** 2 + b.sigma ** 2
+    return math.sqrt(2 * beta ** 2 / c2) * math.exp(-(a.mu - b.mu) ** 2 / (2 * c2))
+
+
+class RatingService:
+    """Ratings of named creature builds, learned from the games they play against each other.
+
+    A build is a fixed set of creature parameters, its creatures are named
+    after it. Matches are scheduled between the pairs whose result would
+    teach the most: uncertain ratings that are close to each other. They
+    are recorded as regular playbacks, and ratings are updated from the
+    winner and final scores of the cataloged headers, once per game, so
+    every update is persisted with the game it came from.
+    """
+    def __init__(self, ratings_config, catalog):
+        self.ratings_config = ratings_config
+        self.catalog = catalog
+        self.catalog.connection.executescript(RATINGS_SCHEMA)
+        self.base_config = load_experiment_config(ratings_config.get('base_config', 'experiment_config.json'))
+        self.creature_type = ratings_config.get('creature_type', self.base_config['creature_types'][0])
+        self.builds = ratings_config['builds']
+        for build in self.builds:
+            if ' ' in build:
+                raise ValueError(f"Build names cannot contain spaces: {build}")
+        self.num_creatures = ratings_config.get('num_creatures', 4)  # Creatures of each build in a match
+        self.beta = ratings_config.get('beta', BETA)
+        self.tau = ratings_config.get('tau', TAU)
+        self.rng = random.Random(ratings_config.get('seed'))
+
+        self.ratings = {build: Rating() for build in self.builds}
+        for row in self.catalog.connection.execute("SELECT * FROM ratings"):
+            if row['build'] in self.ratings:
+                self.ratings[row['build']] = Rating(row['mu'], row['sigma'], row['games'], row['wins'])
+
+    def match_experiment_config(self, build_a, build_b):
+        experiment_config = copy.deepcopy(self.base_config)
+        base_creature_config = self.base_config['creature_config'][self.creature_type]
+        experiment_config['creature_config'] = {build: fixed_creature_config(base_creature_config, self.builds[build])
+                                                for build in (build_a, build_b)}
+        experiment_config['creature_types'] = [build_a, build_b]
+        experiment_config['num_creatures'] = [self.num_creatures, self.num_creatures]
+        experiment_config['catalog'] = self.catalog.path  # The workers record into the catalog the ratings read
+        return experiment_config
+
+    def schedule(self, num_matches):
+        """The num_matches pairs of builds with the most uncertain outcome, a build plays at most once."""
+        def priority(pair):
+            a, b = self.ratings[pair[0]], self.ratings[pair[1]]
+            return match_quality(a, b, self.beta) * (a.sigma ** 2 + b.sigma ** 2)
+
+        pairs = sorted(itertools.combinations(sorted(self.builds), 2), key=priority, reverse=True)
+        scheduled, busy = [], set()
+        for pair in pairs:
+            if len(scheduled) == num_matches:
+                break
+            if not busy.intersection(pair):
+                scheduled.append(pair)
+                busy.update(pair)
+        return scheduled
+
+    def update_from_catalog(self):
+        """Rate every cataloged game between two builds that is not rated yet, returns how many were rated."""
+        connection = self.catalog.connection
+        games = connection.execute(
+            "SELECT g.filename, g.winner FROM games g LEFT JOIN rated_games r ON r.filename = g.filename "
+            "WHERE r.filename IS NULL ORDER BY g.filename").fetchall()
+        rated = 0
+        for game in games:
+            scores = {}
+            for creature in connection.execute("SELECT creature_type, score FROM creatures WHERE filename = ?",
+                                               (game['filename'],)):
+                scores[creature['creature_type']] = scores.get(creature['creature_type'], 0) + creature['score']
+            if len(scores) != 2 or not all(build in self.ratings for build in scores):
+                continue
+            # The winner's build wins, without one the build with the higher total final score
+            winner = game['winner'].split(' ')[0] if game['winner'] else max(scores, key=scores.get)
+            loser = next(build for build in scores if build != winner)
+            if not game['winner'] and scores[winner] == scores[loser]:
+                winner = loser = None
+            else:
+                rate_match(self.ratings[winner], self.ratings[loser], self.beta, self.tau)
+            # The game and the ratings it changed are saved together
+            with connection:
+                connection.execute("INSERT INTO rated_games VALUES (?, ?, ?)", (game['filename'], winner, loser))
+                connection.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?)",
+                                       [(build, self.ratings[build].mu, self.ratings[build].sigma,
+                                         self.ratings[build].games, self.ratings[build].wins)
+                                        for build in (winner, loser) if build is not None])
+            rated += 1
+        return rated
+
+    def run(self, max_games=200, target_sigma=2.0, workers=None):
+        """Play scheduled matches until every sigma is below target_sigma or max_games were played."""
+        self.update_from_catalog()
+        played = 0
+        batch_size = self.ratings_config.get('matches_per_round', max(1, len(self.builds) // 2))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while played < max_games and max(rating.sigma for rating in self.ratings.values()) > target_sigma:
+                pairs = self.schedule(min(batch_size, max_games - played))
+                futures = [executor.submit(run_game, self.match_experiment_config(*pair), self.rng.getrandbits(32),
+                                           1, True, {'rating_match': list(pair)})
+                           for pair in pairs]
+                for future in futures:
+                    future.result()
+                played += len(pairs)
+                self.update_from_catalog()
+                print(f"{played} games played, largest sigma {max(rating.sigma for rating in self.ratings.values()):.2f}")
+        return self.ranking()
+
+    def ranking(self):
+        return sorted(self.ratings.items(), key=lambda item: item[1].conservative(), reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rate AutoChess creature builds by scheduling matches between them.')
+    parser.add_argument('ratings_config', type=str, nargs='?', default='ratings_config.json', help='Path to the ratings configuration.')
+    parser.add_argument('-c', '--catalog', type=str, default=DEFAULT_CATALOG_PATH, help='Path to the catalog database holding the ratings.')
+    parser.add_argument('-g', '--max-games', type=int, default=200, help='Maximum number of games to play in this run.')
+    parser.add_argument('-s', '--target-sigma', type=float, default=2.0, help='Stop once every rating is this certain.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, defaults to the number of CPUs.')
+
+    args = parser.parse_args()
+
+    catalog = PlaybackCatalog(args.catalog)
+    service = RatingService(load_experiment_config(args.ratings_config), catalog)
+    ranking = service.run(args.max_games, args.target_sigma, args.workers)
+    catalog.close()
+    for position, (build, rating) in enumerate(ranking, start=1):
+        print(f"{position}. {build}: {rating.conservative():.2f} (mu {rating.mu:.2f}, sigma {rating.sigma:.2f}, "
+              f"{rating.wins}/{rating.games} wins)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# AutoChessRunningStatistics.py
+
+import math
+
+CREATURE_ATTRIBUTES = ['speed', 'max_turn_rate', 'damage', 'bullet_speed', 'shoot_cooldown', 'bullet_range', 'brake_cooldown', 'brake_power', 'health']
+
+
+class RunningStatistics:
+    """Count, mean and variance of a stream of values, updated one value at a time (Welford)."""
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2  # Sum of squared differences from the mean
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def average(self):
+        return self.mean if self.count else None
+
+    def stdev(self):
+        # Sample standard deviation, like statistics.stdev
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+
+    def to_state(self):
+        return [self.count, self.mean, self.m2]
+
+
+class ExperimentAggregate:
+    """Everything the experiment statistics need, folded in one game at a time."""
+    def __init__(self, state=None):
+        state = state or {}
+        self.num_games = state.get('num_games', 0)
+        # Games per max_turns, so the games ended by time can be counted for any time limit
+        self.max_turns_counts = {int(max_turns): count for max_turns, count in state.get('max_turns_counts', {}).items()}
+        self.score = RunningStatistics(*state.get('score', ()))
+        self.winner_score = RunningStatistics(*state.get('winner_score', ()))
+        attribute_states = state.get('attributes', {})
+        self.attributes = {attribute: RunningStatistics(*attribute_states.get(attribute, ())) for attribute in CREATURE_ATTRIBUTES}
+
+    def add_game(self, game, creatures):
+        self.num_games += 1
+        self.max_turns_counts[game['max_turns']] = self.max_turns_counts.get(game['max_turns'], 0) + 1
+        if game['winner_score'] is not None:
+            self.winner_score.add(game['winner_score'])
+        for creature in creatures:
+            self.score.add(creature['score'])
+            for attribute, running_statistics in self.attributes.items():
+                if creature[attribute] is not None:
+                    running_statistics.add(creature[attribute])
+
+    def games_ended_by_time(self, time_limit):
+        return sum(count for max_turns, count in self.max_turns_counts.items() if max_turns >= time_limit)
+
+    def to_state(self):
+        return {
+            'num_games': self.num_games,
+            'max_turns_counts': self.max_turns_counts,
+            'score': self.score.to_state(),
+            'winner_score': self.winner_score.to_state(),
+            'attributes': {attribute: running_statistics.to_state() for attribute, running_statistics in self.attributes.items()},
+        }
@@ -0,0 +1,196 @@
+# AutoChessServer.py
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from AutoChessBatchSimulation import AutoChessBatchedSimulator, load_experiment_config
+from AutoChessSweep import SuccessiveHalvingSweep
+
+DEFAULT_PORT = 8766
+
+
+def warm_up():
+    # Runs once in every pool worker, importing this module loads the engine, brains and batch simulator
+    return True
+
+
+def run_job_game(experiment_config, experiment_hash, simulation_number, seed, record, return_header):
+    """Play one game of a simulation job in a warm worker, returns its game_summary (and header)."""
+    simulator = AutoChessBatchedSimulator(experiment_config)
+    try:
+        simulator.experiment_hash = experiment_hash
+        random.seed(seed)
+        summary = simulator.run_simulation(simulation_number, record)
+        if return_header:
+            summary['header'] = simulator.game.build_game_record()['header']
+        return summary
+    finally:
+        simulator.catalog.close()
+
+
+class SimulationServer:
+    """Keeps a pool of workers with the engine loaded and runs jobs sent as JSON lines.
+
+    A client sends one JSON object per line and gets back JSON lines:
+    "progress" events while the job runs, then a "done" event with the
+    results, or an "error" event. Jobs:
+
+    - {"job": "simulation", "experiment_config": {...} or "config_path": "...",
+      "num_simulations": n, "seed": s, "record": true, "return_headers": false}
+      plays n games on the pool, seeded from s, and returns their game_summary,
+      with the playback path when recorded and the header when asked for.
+    - {"job": "sweep", "sweep_config": {...} or "config_path": "..."} runs a
+      successive-halving sweep and returns its ranking.
+    - {"job": "ping"} and {"job": "shutdown"}.
+
+    Several clients can run jobs at the same time, their games share the pool.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.executor = None
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        # Start every worker now, so the first job does not pay for it
+        await asyncio.gather(*(loop.run_in_executor(self.executor, warm_up) for _ in range(self.workers or os.cpu_count())))
+        self.server = await asyncio.start_server(self.handle_client, host, port, limit=1 << 24)
+        print(f"Simulation server listening on {host}:{self.server.sockets[0].getsockname()[1]}")
+
+    async def serve_forever(self):
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.executor.shutdown()
+
+    async def handle_client(self, reader, writer):
+        async def send(message):
+            writer.write(json.dumps(message).encode('utf-8') + b'\n')
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    job = json.loads(line)
+                    if job['job'] == 'ping':
+                        await send({'event': 'done', 'results': 'pong'})
+                    elif job['job'] == 'shutdown':
+                        await send({'event': 'done', 'results': 'shutting down'})
+                        self.server.close()
+                        asyncio.get_running_loop().call_soon(self.stop)
+                        break
+                    elif job['job'] == 'simulation':
+                        await self.run_simulation_job(job, send)
+                    elif job['job'] == 'sweep':
+                        await self.run_sweep_job(job, send)
+                    else:
+                        raise ValueError(f"Unknown job: {job['job']}")
+                except Exception as e:
+                    await send({'event': 'error', 'error': f"{type(e).__name__}: {e}"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def stop(self):
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    async def run_simulation_job(self, job, send):
+        experiment_config = job.get('experiment_config') or load_experiment_config(job['config_path'])
+        num_simulations = job.get('num_simulations', experiment_config['num_simulations'])
+        record = job.get('record', True)
+        # The batch simulator here only names the experiment and writes its batch output
+        simulator = AutoChessBatchedSimulator(experiment_config)
+        rng = random.Random(job.get('seed'))
+        loop = asyncio.get_running_loop()
+
+        async def play(number, seed):
+            return number, await loop.run_in_executor(self.executor, run_job_game, experiment_config,
+                                                      simulator.experiment_hash, number, seed, record,
+                                                      job.get('return_headers', False))
+
+        games = [play(number, rng.getrandbits(32)) for number in range(1, num_simulations + 1)]
+        summaries = {}
+        try:
+            for game in asyncio.as_completed(games):
+                number, summary = await game
+                summaries[number] = summary
+                await send({'event': 'progress', 'done': len(summaries), 'total': num_simulations,
+                            'simulation_number': number, 'winner': summary['winner'], 'path': summary.get('path')})
+            # Games finish out of order, results are given in simulation number order
+            results = [summaries[number] for number in sorted(summaries)]
+            if record and results:
+                simulator.save_batch_output("batch_output", len(results), results[-1]['score_values'])
+            await send({'event': 'done', 'experiment_hash': simulator.experiment_hash, 'results': results})
+        finally:
+            simulator.catalog.close()
+
+    async def run_sweep_job(self, job, send):
+        sweep_config = job.get('sweep_config') or load_experiment_config(job['config_path'])
+        loop = asyncio.get_running_loop()
+        progress = asyncio.Queue()
+
+        def report(rung):
+            # Called from the sweep thread
+            loop.call_soon_threadsafe(progress.put_nowait, rung)
+
+        def run_sweep():
+            sweep = SuccessiveHalvingSweep(sweep_config)
+            ranking = sweep.run(executor=self.executor, progress=report)
+            output_path = sweep.save(ranking)
+            return output_path, [candidate.to_dict() for candidate in ranking]
+
+        sweep_future = loop.run_in_executor(None, run_sweep)
+        while not sweep_future.done() or not progress.empty():
+            getter = asyncio.ensure_future(progress.get())
+            await asyncio.wait([getter, sweep_future], return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                await send({'event': 'progress', 'rung': getter.result()})
+            else:
+                getter.cancel()
+        output_path, ranking = await sweep_future
+        await send({'event': 'done', 'path': output_path, 'results': ranking})
+
+
+def submit_job(job, host='127.0.0.1', port=DEFAULT_PORT):
+    """Send a job to a running server and yield its events, the last one is "done" or "error"."""
+    with socket.create_connection((host, port)) as sock:
+        sock.sendall(json.dumps(job).encode('utf-8') + b'\n')
+        with sock.makefile('r', encoding='utf-8') as lines:
+            for line in lines:
+                event = json.loads(line)
+                yield event
+                if event['event'] in ('done', 'error'):
+                    break
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve AutoChess simulation and sweep jobs from a warm worker pool.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, defaults to the number of CPUs.')
+
+    args = parser.parse_args()
+
+    async def serve():
+        server = SimulationServer(args.workers)
+        await server.start(args.host, args.port)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+if __name__ == "__main__":
+    main()
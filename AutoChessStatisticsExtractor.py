@@ -1,63 +1,26 @@
 import os
 import json
 import csv
+import argparse
 from datetime import datetime
-import statistics
-
-def extract_creature_statistics(game_data):
-    creatures_stats = []
-    winner = game_data['header']['winner']
-
-    for creature in game_data['header']['creatures']:
-        creature_stats = {
-            'game_filename': game_data['filename'],
-            'creature_id': creature['id'],
-            'winner': 1 if creature['name'] == winner else 0,  # Update the logic here
-            'creature_type': creature['name'].split(' ')[0],
-            'speed': creature['speed'],
-            'max_turn_rate': creature['max_turn_rate'],
-            'damage': creature['damage'],
-            'bullet_speed': creature['bullet_speed'],
-            'shoot_cooldown': creature['shoot_cooldown'],
-            'bullet_range': creature['bullet_range'],
-            'score': creature['score'],
-            'brake_cooldown': creature['brake_cooldown'],
-            'brake_power': creature['brake_power'],
-            'experiment_hash': game_data['experiment_hash']
-        }
-        creatures_stats.append(creature_stats)
-
-    return creatures_stats
-
-def extract_game_statistics(game_data):
-    header = game_data['header']
-    winner = header['winner']
-    creatures_stats = extract_creature_statistics(game_data)
-    total_score = sum(creature['score'] for creature in creatures_stats)
-    num_creatures = len(creatures_stats)
-
-    # Calculate average score per player
-    avg_score_per_player = total_score / num_creatures
-
-    # Get the winner's score directly from the game data
-    winner_score = header['winner_score']
-
-    # Find the maximum score among all creatures
-    max_score = max(creature['score'] for creature in creatures_stats)
-
-    return {
-        'filename': game_data['filename'],
-        'num_creatures': num_creatures,
-        'total_score': total_score,
-        'avg_score_per_player': avg_score_per_player,
-        'winner': winner,
-        'winner_score': winner_score,
-        'max_turns': header['max_turns'],
-        'max_score': max_score,
-        'experiment_hash': game_data['experiment_hash']  # Add experiment_hash to game stats
-    }
-
-def extract_experiment_statistics(experiment_data, game_stats, creature_stats):
+from AutoChessCatalog import PlaybackCatalog, DEFAULT_CATALOG_PATH
+from AutoChessRunningStatistics import ExperimentAggregate
+
+# Aggregation state kept next to the catalog rows it is computed from
+STATISTICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS statistics_folded (
+    filename TEXT PRIMARY KEY,
+    experiment_hash TEXT,
+    file_mtime REAL,
+    file_size INTEGER
+);
+CREATE TABLE IF NOT EXISTS statistics_state (
+    experiment_hash TEXT PRIMARY KEY,
+    state TEXT
+);
+"""
+
+def extract_experiment_statistics(experiment_data, aggregate):
     experiment_config = experiment_data['experiment_config']
     experiment_hash = experiment_data['experiment_hash']
     
@@ -66,34 +29,14 @@ def extract_experiment_statistics(experiment_data, game_stats, creature_stats):
 
     # Calculate percentage of games that did not end by maximum turns
     num_simulations = experiment_data['num_simulations']
-    num_games_ended_by_time = sum(1 for game in game_stats if game['max_turns'] >= experiment_config['time_limit'])
+    num_games_ended_by_time = aggregate.games_ended_by_time(experiment_config['time_limit'])
     pct_games_not_ended_by_time = (num_simulations - num_games_ended_by_time) / num_simulations * 100
- 
-
-    # Calculate average score and standard deviation for all creatures in the experiment
-    all_creature_scores = [creature['score'] for creature in creature_stats if creature['experiment_hash'] == experiment_hash]
-    avg_score = statistics.mean(all_creature_scores)
-    std_score = statistics.stdev(all_creature_scores)
-
-    # Calculate average score and standard deviation for winning creatures in the experiment
-    winner_scores = [game['winner_score'] for game in game_stats if game['experiment_hash'] == experiment_hash and game['winner_score'] is not None]
-    if winner_scores:
-        avg_winner_score = statistics.mean(winner_scores)
-        std_winner_score = statistics.stdev(winner_scores)
-    else:
-        avg_winner_score = None
-        std_winner_score = None
 
     # Calculate average and standard deviation for each creature attribute
     attribute_stats = {}
-    for attribute in ['speed', 'max_turn_rate', 'damage', 'bullet_speed', 'shoot_cooldown', 'bullet_range', 'brake_cooldown', 'brake_power', 'health']:
-        attribute_values = [creature[attribute] for creature in creature_stats if creature['experiment_hash'] == experiment_hash and attribute in creature]
-        if attribute_values:
-            attribute_stats[f'avg_{attribute}'] = statistics.mean(attribute_values)
-            attribute_stats[f'std_{attribute}'] = statistics.stdev(attribute_values)
-        else:
-            attribute_stats[f'avg_{attribute}'] = None
-            attribute_stats[f'std_{attribute}'] = None
+    for attribute, running_statistics in aggregate.attributes.items():
+        attribute_stats[f'avg_{attribute}'] = running_statistics.average()
+        attribute_stats[f'std_{attribute}'] = running_statistics.stdev()
 
     return {
         'experiment_hash': experiment_hash,
@@ -105,13 +48,54 @@ def extract_experiment_statistics(experiment_data, game_stats, creature_stats):
         'arena_sizes': ', '.join(map(str, experiment_config['arena_sizes'])),
         'jitter_range': experiment_config['jitter_range'],
         'pct_games_not_ended_by_time': pct_games_not_ended_by_time,
-        'avg_score': avg_score,
-        'std_score': std_score,
-        'avg_winner_score': avg_winner_score,
-        'std_winner_score': std_winner_score,
+        # Average score and standard deviation for all creatures, then for the winners
+        'avg_score': aggregate.score.average(),
+        'std_score': aggregate.score.stdev(),
+        'avg_winner_score': aggregate.winner_score.average(),
+        'std_winner_score': aggregate.winner_score.stdev(),
         **attribute_stats
     }
 
+def fold_new_games(catalog):
+    """Fold the cataloged games that are not in the saved aggregates yet, returns the aggregates of every experiment.
+
+    A game is folded once, identified by its file's mtime and size. When a
+    folded playback changes or disappears, its experiment is rebuilt from
+    the catalog, since a value cannot be taken back out of the aggregate.
+    """
+    connection = catalog.connection
+    connection.executescript(STATISTICS_SCHEMA)
+
+    stale_experiments = {row['experiment_hash'] for row in connection.execute(
+        "SELECT f.experiment_hash FROM statistics_folded f LEFT JOIN games g ON g.filename = f.filename "
+        "WHERE g.filename IS NULL OR g.file_mtime != f.file_mtime OR g.file_size != f.file_size")}
+    with connection:
+        for experiment_hash in stale_experiments:
+            connection.execute("DELETE FROM statistics_folded WHERE experiment_hash IS ?", (experiment_hash,))
+            connection.execute("DELETE FROM statistics_state WHERE experiment_hash IS ?", (experiment_hash,))
+
+    aggregates = {row['experiment_hash']: ExperimentAggregate(json.loads(row['state']))
+                  for row in connection.execute("SELECT experiment_hash, state FROM statistics_state")}
+
+    new_games = connection.execute(
+        "SELECT g.* FROM games g LEFT JOIN statistics_folded f ON f.filename = g.filename "
+        "WHERE f.filename IS NULL ORDER BY g.filename").fetchall()
+    for game in new_games:
+        creatures = connection.execute("SELECT * FROM creatures WHERE filename = ?", (game['filename'],)).fetchall()
+        aggregate = aggregates.setdefault(game['experiment_hash'], ExperimentAggregate())
+        aggregate.add_game(game, creatures)
+
+    # The folded games and the aggregates that include them are saved together
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO statistics_folded VALUES (?, ?, ?, ?)",
+                               [(game['filename'], game['experiment_hash'], game['file_mtime'], game['file_size']) for game in new_games])
+        connection.executemany("INSERT OR REPLACE INTO statistics_state VALUES (?, ?)",
+                               [(experiment_hash, json.dumps(aggregate.to_state())) for experiment_hash, aggregate in aggregates.items()
+                                if experiment_hash is not None])
+
+    print(f"Folded {len(new_games)} new games into the statistics of {len(aggregates)} experiments")
+    return aggregates
+
 def write_statistics_to_csv(creatures_stats, game_stats, experiment_stats):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
@@ -151,35 +135,37 @@ def write_statistics_to_csv(creatures_stats, game_stats, experiment_stats):
         writer.writeheader()
         writer.writerows(experiment_stats)
 
-def extract_all_statistics():
-    all_creatures_stats = []
-    all_game_stats = []
+def extract_all_statistics(catalog_path=DEFAULT_CATALOG_PATH, workers=None):
     all_experiment_stats = []
 
-    # Extract creature and game statistics from playback files
-    for root, dirs, files in os.walk('playbacks'):
-        for file in files:
-            if file.endswith('.json') and 'AutoChessSimulationRun' in file:
-                with open(os.path.join(root, file), 'r') as f:
-                    game_data = json.load(f)
-                    game_data['filename'] = file
-                    all_creatures_stats.extend(extract_creature_statistics(game_data))
-                    all_game_stats.append(extract_game_statistics(game_data))
-
-    # Extract experiment statistics from experiment files
-    for root, dirs, files in os.walk('experiments'):
-        for file in files:
-            if file.endswith('.json') and file.startswith('batch_output_'):
-                with open(os.path.join(root, file), 'r') as f:
-                    batch_data = json.load(f)
-                    experiment_hash = batch_data['experiment_hash']
-                    experiment_creatures_stats = [creature for creature in all_creatures_stats if creature['experiment_hash'] == experiment_hash]
-                    experiment_game_stats = [game for game in all_game_stats if game['experiment_hash'] == experiment_hash]
-                    experiment_stats = extract_experiment_statistics(batch_data, experiment_game_stats, experiment_creatures_stats)
-                    all_experiment_stats.append(experiment_stats)
+    # Playbacks and experiments not recorded through the catalog are added first, parsed on a pool of workers
+    catalog = PlaybackCatalog(catalog_path)
+    catalog.backfill('playbacks', 'experiments', workers=workers)
+
+    # Only the games added since the last run are aggregated
+    aggregates = fold_new_games(catalog)
+
+    # Extract creature and game statistics from the catalog, without reading the playback events
+    all_creatures_stats = catalog.creature_statistics()
+    all_game_stats = catalog.game_statistics()
+
+    # Extract experiment statistics from the cataloged batch outputs and their aggregates
+    for batch_data in catalog.experiments():
+        aggregate = aggregates.get(batch_data['experiment_hash'], ExperimentAggregate())
+        all_experiment_stats.append(extract_experiment_statistics(batch_data, aggregate))
+    catalog.close()
 
     # Write statistics to CSV files
     write_statistics_to_csv(all_creatures_stats, all_game_stats, all_experiment_stats)
 
+def main():
+    parser = argparse.ArgumentParser(description='Extract creature, game and experiment statistics to CSV files.')
+    parser.add_argument('-c', '--catalog', type=str, default=DEFAULT_CATALOG_PATH, help='Path to the catalog database.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes parsing new playbacks, defaults to the number of CPUs.')
+
+    args = parser.parse_args()
+
+    extract_all_statistics(args.catalog, args.workers)
+
 if __name__ == "__main__":
-    extract_all_statistics()
\ No newline at end of file
+    main()
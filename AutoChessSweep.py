@@ -0,0 +1,219 @@
+# AutoChessSweep.py
+
+import argparse
+import copy
+import itertools
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from AutoChessBatchSimulation import AutoChessBatchedSimulator, load_experiment_config, creature_type_of
+from AutoChessRunningStatistics import RunningStatistics
+
+
+def sample_candidates(search_space, num_candidates, rng):
+    """Up to num_candidates distinct assignments of the search space, each a dict of parameter to range."""
+    parameters = sorted(search_space)
+    grid = list(itertools.product(*(search_space[parameter] for parameter in parameters)))
+    if num_candidates and num_candidates < len(grid):
+        grid = rng.sample(grid, num_candidates)
+    return [dict(zip(parameters, values)) for values in grid]
+
+
+def candidate_experiment_config(base_config, creature_type, candidate_type, parameters, num_creatures):
+    """An experiment where creatures with the candidate ranges fight creatures of the base creature_type."""
+    experiment_config = copy.deepcopy(base_config)
+    candidate_config = copy.deepcopy(base_config['creature_config'][creature_type])
+    candidate_config.update(parameters)
+    experiment_config['creature_config'][candidate_type] = candidate_config
+    experiment_config['creature_types'] = [candidate_type, creature_type]
+    experiment_config['num_creatures'] = list(num_creatures)
+    return experiment_config
+
+
+def run_candidate_games(experiment_config, experiment_hash, first_simulation, num_games, seed):
+    """Run games of one candidate in a worker process, returns their game_summary."""
+    random.seed(seed)
+    simulator = AutoChessBatchedSimulator(experiment_config)
+    # Every task of a candidate records its games under the same experiment
+    simulator.experiment_hash = experiment_hash
+    try:
+        return simulator.run_batch_simulations(num_games, first_simulation)
+    finally:
+        simulator.catalog.close()
+
+
+class SweepCandidate:
+    """One point of the search space, with the results of the games it has played so far."""
+    def __init__(self, index, parameters, experiment_config, candidate_type):
+        self.index = index
+        self.parameters = parameters
+        self.candidate_type = candidate_type
+        self.simulator = AutoChessBatchedSimulator(experiment_config)
+        self.wins = 0
+        self.score_advantage = RunningStatistics()
+        self.score_values = None
+        self.eliminated_at_rung = None
+
+    @property
+    def experiment_hash(self):
+        return self.simulator.experiment_hash
+
+    @property
+    def num_games(self):
+        return self.score_advantage.count
+
+    def add_game(self, summary):
+        self.score_values = summary['score_values']
+        if creature_type_of(summary['winner']) == self.candidate_type:
+            self.wins += 1
+        candidate_scores = [score for name, score in summary['scores'].items()
+                            if creature_type_of(name) == self.candidate_type]
+        opponent_scores = [score for name, score in summary['scores'].items()
+                           if creature_type_of(name) != self.candidate_type]
+        # Mean score of a candidate creature minus the mean score of an opponent
+        self.score_advantage.add(sum(candidate_scores) / max(len(candidate_scores), 1)
+                                 - sum(opponent_scores) / max(len(opponent_scores), 1))
+
+    def win_rate(self):
+        return self.wins / self.num_games if self.num_games else 0.0
+
+    def ranking_key(self):
+        return (self.win_rate(), self.score_advantage.average() or 0.0)
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'experiment_hash': self.experiment_hash,
+            'parameters': self.parameters,
+            'num_games': self.num_games,
+            'wins': self.wins,
+            'win_rate': self.win_rate(),
+            'score_advantage': self.score_advantage.average(),
+            'score_advantage_stdev': self.score_advantage.stdev(),
+            'eliminated_at_rung': self.eliminated_at_rung,
+        }
+
+
+class SuccessiveHalvingSweep:
+    """Successive halving over creature_config ranges.
+
+    Every candidate plays min_games, then only the best 1/reduction_factor
+    of them go on to the next rung, where the total number of games per
+    candidate is multiplied by reduction_factor. Candidates are ranked by
+    their win rate against creatures of the base configuration, then by
+    their mean score advantage over them. The games of a rung are split
+    in tasks of games_per_task and run on a pool of worker processes. Each
+    candidate is an experiment of its own, recorded in the usual playbacks
+    and experiments layout.
+    """
+    def __init__(self, sweep_config):
+        self.sweep_config = sweep_config
+        self.base_config = load_experiment_config(sweep_config.get('base_config', 'experiment_config.json'))
+        self.creature_type = sweep_config.get('creature_type', self.base_config['creature_types'][0])
+        self.candidate_type = f"{self.creature_type}_candidate"
+        self.num_creatures = sweep_config.get('num_creatures', [4, 4])  # Candidate creatures, then base creatures
+        self.min_games = sweep_config.get('min_games', 2)
+        self.reduction_factor = sweep_config.get('reduction_factor', 2)
+        self.games_per_task = sweep_config.get('games_per_task', 2)
+        self.max_rungs = sweep_config.get('max_rungs')
+        self.rng = random.Random(sweep_config.get('seed'))
+
+        parameter_sets = sample_candidates(sweep_config['search_space'], sweep_config.get('num_candidates'), self.rng)
+        self.candidates = [
+            SweepCandidate(index, parameters,
+                           candidate_experiment_config(self.base_config, self.creature_type, self.candidate_type,
+                                                       parameters, self.num_creatures),
+                           self.candidate_type)
+            for index, parameters in enumerate(parameter_sets)]
+        self.rungs = []
+
+    def run_rung(self, executor, survivors, target_games):
+        # Bring every survivor to target_games, tasks of all candidates share the pool
+        futures = []
+        for candidate in survivors:
+            for first_game in range(candidate.num_games, target_games, self.games_per_task):
+                num_games = min(self.games_per_task, target_games - first_game)
+                futures.append((candidate, executor.submit(
+                    run_candidate_games, candidate.simulator.experiment_config, candidate.experiment_hash,
+                    first_game + 1, num_games, self.rng.getrandbits(32))))
+        for candidate, future in futures:
+            for summary in future.result():
+                candidate.add_game(summary)
+
+    def run(self, workers=None, executor=None, progress=None):
+        """Run the sweep, returns the candidates from best to worst.
+
+        An executor can be given to share a warm pool, otherwise one of
+        workers processes is made. progress(rung) is called after every rung.
+        """
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return self.run(executor=executor, progress=progress)
+
+        survivors = list(self.candidates)
+        target_games = self.min_games
+        rung = 0
+        while True:
+            print(f"Rung {rung}: {len(survivors)} candidates, {target_games} games each")
+            self.run_rung(executor, survivors, target_games)
+            survivors.sort(key=lambda candidate: candidate.ranking_key(), reverse=True)
+            self.rungs.append({'rung': rung, 'games_per_candidate': target_games,
+                               'candidates': [candidate.index for candidate in survivors]})
+            if progress is not None:
+                progress(self.rungs[-1])
+            if len(survivors) <= 1 or (self.max_rungs and rung + 1 >= self.max_rungs):
+                break
+            num_kept = max(1, math.ceil(len(survivors) / self.reduction_factor))
+            for candidate in survivors[num_kept:]:
+                candidate.eliminated_at_rung = rung
+            survivors = survivors[:num_kept]
+            if len(survivors) == 1:
+                break
+            target_games *= self.reduction_factor
+            rung += 1
+
+        # Candidates that went further rank above the ones eliminated before them
+        return sorted(self.candidates, key=lambda candidate: (
+            candidate.eliminated_at_rung if candidate.eliminated_at_rung is not None else math.inf,
+            candidate.ranking_key()), reverse=True)
+
+    def save(self, ranking):
+        """Write the batch output of every candidate and the sweep results to the experiments directory."""
+        for candidate in self.candidates:
+            if candidate.num_games:
+                candidate.simulator.save_batch_output(
+                    f"batch_output_{candidate.experiment_hash}", candidate.num_games, candidate.score_values,
+                    {'sweep_candidate': candidate.to_dict()})
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join("experiments", f"sweep_{timestamp}.json")
+        with open(output_path, 'w') as file:
+            json.dump({
+                'sweep_config': self.sweep_config,
+                'rungs': self.rungs,
+                'ranking': [candidate.to_dict() for candidate in ranking],
+            }, file, indent=4)
+        for candidate in self.candidates:
+            candidate.simulator.catalog.close()
+        return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Successive-halving sweep over AutoChess creature_config ranges.')
+    parser.add_argument('sweep_config', type=str, nargs='?', default='sweep_config.json', help='Path to the sweep configuration.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, defaults to the number of CPUs.')
+
+    args = parser.parse_args()
+
+    sweep = SuccessiveHalvingSweep(load_experiment_config(args.sweep_config))
+    ranking = sweep.run(args.workers)
+    output_path = sweep.save(ranking)
+    best = ranking[0]
+    print(f"Best candidate {best.index} ({best.experiment_hash}): {best.parameters}, "
+          f"win rate {best.win_rate():.2f} over {best.num_games} games")
+    print(f"Sweep results saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# AutoChessTrajectoryExport.py
+
+import argparse
+import os
+import struct
+import zipfile
+from collections import defaultdict
+import numpy as np
+from AutoChessMapReduce import map_reduce
+from AutoChessPlaybackIO import is_playback_path, load_playback
+
+# Columns of the creature table, one row per (game, tick, creature) while the creature is alive.
+# Each row holds the state at the end of its tick.
+CREATURE_COLUMNS = {
+    'game': np.int32,
+    'tick': np.int32,
+    'object_id': np.int32,
+    'x': np.float64,
+    'y': np.float64,
+    'angle': np.float64,
+    'health': np.float64,
+    'score': np.float64,
+    'is_braking': np.bool_,
+}
+
+# Columns of the projectile side table, one row per projectile.
+# Projectiles still flying when the game ended have destroyed_tick -1 and NaN final positions.
+PROJECTILE_COLUMNS = {
+    'game': np.int32,
+    'object_id': np.int32,
+    'origin_id': np.int32,
+    'created_tick': np.int32,
+    'x': np.float64,
+    'y': np.float64,
+    'angle': np.float64,
+    'speed': np.float64,
+    'destroyed_tick': np.int32,
+    'final_x': np.float64,
+    'final_y': np.float64,
+}
+
+
+def _forward_fill(num_ticks, ticks, columns, values, initial):
+    """A (num_ticks, len(initial)) array of the last value set at or before each tick.
+
+    ticks, columns and values are the changes in log order, the last change
+    of a tick wins. Ticks before the first change of a column hold initial.
+    """
+    filled = np.empty((num_ticks,) + initial.shape, dtype=initial.dtype)
+    filled[:] = initial
+    if len(ticks) == 0:
+        return filled
+    # Keep only the last change of every (tick, column)
+    keys = ticks * len(initial) + columns
+    reversed_keys = keys[::-1]
+    _, last = np.unique(reversed_keys, return_index=True)
+    last = len(keys) - 1 - last
+    changed = np.zeros((num_ticks, len(initial)), dtype=bool)
+    changed[ticks[last], columns[last]] = True
+    filled[ticks[last], columns[last]] = values[last]
+    # Index of the last changed tick of every cell, -1 before the first change
+    source = np.where(changed, np.arange(num_ticks)[:, None], -1)
+    np.maximum.accumulate(source, axis=0, out=source)
+    column_index = np.broadcast_to(np.arange(len(initial)), source.shape)
+    result = filled[np.maximum(source, 0), column_index]
+    result[source < 0] = initial[column_index[source < 0]]
+    return result
+
+
+def extract_trajectories(file_path):
+    """Creature and projectile columns of one playback, with its experiment hash and arena."""
+    data = load_playback(file_path)
+
+    header = data['header']
+    creatures = header['creatures']
+    creature_columns = {creature['id']: column for column, creature in enumerate(creatures)}
+    num_ticks = max((int(tick) for tick in data['events']), default=-1) + 1
+
+    # Older playbacks only have the final state in the header, so their ticks before the first
+    # change of an attribute get the final position and angle, and full health
+    initial = {
+        'x': np.array([creature.get('initial_position', creature['position'])[0] for creature in creatures], dtype=float),
+        'y': np.array([creature.get('initial_position', creature['position'])[1] for creature in creatures], dtype=float),
+        'angle': np.array([creature.get('initial_angle', creature['angle']) for creature in creatures], dtype=float),
+        'health': np.array([creature.get('max_health', creature['health']) for creature in creatures], dtype=float),
+        'score': np.zeros(len(creatures)),
+        'is_braking': np.zeros(len(creatures), dtype=bool),
+    }
+
+    # One pass over the log, everything after it is array work
+    changes = {attribute: ([], [], []) for attribute in ('position', 'angle', 'health', 'score', 'is_braking')}
+    death_ticks = np.full(len(creatures), num_ticks - 1)
+    projectiles = []
+    projectile_rows = {}
+    for tick, events in data['events'].items():
+        tick = int(tick)
+        for event in events:
+            event_type = event['type']
+            if event_type == 'deltaSetter':
+                column = creature_columns.get(event['id'])
+                if column is None or event['attribute'] not in changes:
+                    continue
+                change_ticks, change_columns, change_values = changes[event['attribute']]
+                change_ticks.append(tick)
+                change_columns.append(column)
+                change_values.append(event['value'])
+            elif event_type == 'creation':
+                if event['object_type'] == 'Projectile':
+                    details = event['details']
+                    projectile_rows[event['id']] = len(projectiles)
+                    projectiles.append([event['id'], event['origin_id'], tick, details['position'][0],
+                                        details['position'][1], details['angle'], details['speed'],
+                                        -1, np.nan, np.nan])
+            elif event_type == 'destruction':
+                if event['id'] in creature_columns:
+                    death_ticks[creature_columns[event['id']]] = tick
+                elif event['id'] in projectile_rows:
+                    projectile = projectiles[projectile_rows[event['id']]]
+                    final_position = event.get('final_position') or (np.nan, np.nan)
+                    projectile[7:] = [tick, final_position[0], final_position[1]]
+
+    def filled(attribute, initial_values, value_index=None, dtype=float):
+        change_ticks, change_columns, change_values = changes[attribute]
+        values = np.array(change_values, dtype=dtype)
+        if value_index is not None:
+            values = values[:, value_index] if len(values) else values.reshape(0)
+        return _forward_fill(num_ticks, np.array(change_ticks, dtype=np.int64),
+                             np.array(change_columns, dtype=np.int64), values, initial_values)
+
+    state = {
+        'x': filled('position', initial['x'], 0),
+        'y': filled('position', initial['y'], 1),
+        'angle': filled('angle', initial['angle']),
+        'health': filled('health', initial['health']),
+        'score': filled('score', initial['score']),
+        'is_braking': filled('is_braking', initial['is_braking'], dtype=bool),
+    }
+
+    # A creature has rows up to and including the tick it was destroyed in
+    alive = np.arange(num_ticks)[:, None] <= death_ticks[None, :]
+    tick_index, column_index = np.nonzero(alive)
+    creature_table = {
+        'tick': tick_index,
+        'object_id': np.array([creature['id'] for creature in creatures], dtype=np.int64)[column_index],
+    }
+    for name, values in state.items():
+        creature_table[name] = values[tick_index, column_index]
+
+    projectiles = np.array(projectiles, dtype=float).reshape(-1, 10)
+    projectile_table = {name: projectiles[:, index] for index, name in enumerate(list(PROJECTILE_COLUMNS)[1:])}
+
+    return {
+        'experiment_hash': data.get('experiment_hash'),
+        'arena': (header['arena']['width'], header['arena']['height']),
+        'creatures': creature_table,
+        'projectiles': projectile_table,
+    }
+
+
+class TrajectoryAccumulator:
+    """Per-experiment lists of the per-playback columns, merged in the parent process."""
+    def __init__(self):
+        self.experiments = defaultdict(lambda: {'games': [], 'arenas': [], 'creatures': [], 'projectiles': []})
+
+    def add(self, file_path, trajectories):
+        experiment = self.experiments[trajectories['experiment_hash'] or 'unknown']
+        game = len(experiment['games'])
+        experiment['games'].append(os.path.basename(file_path))
+        experiment['arenas'].append(trajectories['arena'])
+        for table in ('creatures', 'projectiles'):
+            columns = dict(trajectories[table])
+            columns['game'] = np.full(len(next(iter(columns.values()))), game)
+            experiment[table].append(columns)
+
+    def save(self, output_dir):
+        """Write one trajectories_<experiment_hash>.npz per experiment, returns their paths."""
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for experiment_hash, experiment in sorted(self.experiments.items()):
+            arrays = {
+                'games': np.array(experiment['games']),
+                'arenas': np.array(experiment['arenas'], dtype=float).reshape(-1, 2),
+            }
+            for table, columns in (('creatures', CREATURE_COLUMNS), ('projectiles', PROJECTILE_COLUMNS)):
+                for name, dtype in columns.items():
+                    parts = [part[name] for part in experiment[table]]
+                    arrays[f'{table}_{name}'] = np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype)
+            path = os.path.join(output_dir, f"trajectories_{experiment_hash}.npz")
+            # Uncompressed, so load_trajectories can memory-map every column
+            np.savez(path, **arrays)
+            paths.append(path)
+        return paths
+
+
+def load_trajectories(path, mmap_mode='r'):
+    """The columns of an archive written by export_trajectories, as a dict of arrays.
+
+    np.load never memory-maps the members of an .npz, but np.savez stores
+    them uncompressed, so each one is mapped at its offset in the zip file.
+    Compressed members, or mmap_mode=None, are read into memory.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if mmap_mode is None or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # The data starts after the local file header, whose name and extra field lengths may
+            # differ from the central directory entry
+            file.seek(info.header_offset)
+            local_header = file.read(30)
+            name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            if np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=file.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+
+def export_trajectories(playback_dir='playbacks', output_dir='trajectories', workers=None):
+    """Export every playback of a directory to per-experiment columnar archives, returns their paths."""
+    file_paths = []
+    for root, dirs, files in os.walk(playback_dir):
+        file_paths.extend(os.path.join(root, file) for file in files
+                          if is_playback_path(file) and 'AutoChessSimulationRun' in file)
+    file_paths.sort()
+    accumulator = TrajectoryAccumulator()
+    map_reduce(file_paths, extract_trajectories, accumulator.add, workers)
+    return accumulator.save(output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export AutoChess replays to per-experiment columnar NumPy archives.')
+    parser.add_argument('playback_dir', type=str, nargs='?', default='playbacks', help='Directory containing the playback files.')
+    parser.add_argument('-o', '--output-dir', type=str, default='trajectories', help='Directory for the .npz archives.')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, defaults to the number of CPUs.')
+
+    args = parser.parse_args()
+
+    for path in export_trajectories(args.playback_dir, args.output_dir, args.workers):
+        print(f"Trajectories saved to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,13 @@
 
 # Check if a directory path and FPS value were provided as arguments
 if [ -z "$1" ] || [ -z "$2" ]; then
-    echo "Usage: $0 /path/to/playbacks/directory fps"
+    echo "Usage: $0 /path/to/playbacks/directory fps [AutoChessBatchVideo.py options]"
     exit 1
 fi
 
 playback_dir=$1
-output_dir=$playback_dir
 fps=$2
+shift 2
 
-# Iterate over all JSON files in the playback directory, excluding the batch output file
-for file in "$playback_dir"/*.json; do
-    if [[ $file == *.json && $file != *"batch_output"* ]]; then
-        python AutoChessPlaybackToVideo.py "$file" --fps "$fps"
-    fi
-done
\ No newline at end of file
+# Render all playbacks of the directory on a pool of headless workers, skipping up-to-date videos
+python AutoChessBatchVideo.py "$playback_dir" "$fps" "$@"